@@ -0,0 +1,266 @@
+"""
+Reproducible in-process benchmark of the recognition pipeline.
+
+    python benchmark.py --gallery-size 10000 --source random --concurrency 1 4 8 --output bench.json
+
+Builds a synthetic gallery (random ArcFace-like embeddings, or dataset/
+images plus augmentation synced through a local stand-in bucket), then
+drives the /predict/ and /upload_data/ code paths of main.py directly and
+reports per-stage latency (decode, detect, embed, search, sync),
+throughput under concurrency and peak RSS as JSON.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from gallery import IMAGE_EXTENSIONS
+from content_store import Manifest, enrollment_entry, write_object
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = np.sort(np.asarray(samples)) * 1000
+    return {
+        "count": len(ordered),
+        "mean_ms": round(float(ordered.mean()), 3),
+        "p50_ms": round(float(np.percentile(ordered, 50)), 3),
+        "p95_ms": round(float(np.percentile(ordered, 95)), 3),
+        "p99_ms": round(float(np.percentile(ordered, 99)), 3),
+        "max_ms": round(float(ordered[-1]), 3),
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class StageTimer:
+    """Collects wall-clock samples per pipeline stage from wrapped callables."""
+
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self._samples.setdefault(stage, []).append(elapsed)
+        return timed
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+
+    def report(self):
+        with self._lock:
+            return {stage: percentiles(samples) for stage, samples in sorted(self._samples.items())}
+
+
+def dataset_images(dataset_dir):
+    """[(person, BGR image)] for every readable image under dataset_dir/<person>/."""
+    images = []
+    for person in sorted(os.listdir(dataset_dir)):
+        folder = os.path.join(dataset_dir, person)
+        if not os.path.isdir(folder):
+            continue
+        for filename in sorted(os.listdir(folder)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                img = cv2.imread(os.path.join(folder, filename))
+                if img is not None:
+                    images.append((person, img))
+    return images
+
+
+def augment(img, rng):
+    """Random flip, brightness/contrast jitter, small rotation and rescale."""
+    if rng.random() < 0.5:
+        img = cv2.flip(img, 1)
+    height, width = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), rng.uniform(-10, 10), rng.uniform(0.9, 1.1))
+    img = cv2.warpAffine(img, matrix, (width, height), borderMode=cv2.BORDER_REFLECT)
+    return cv2.convertScaleAbs(img, alpha=rng.uniform(0.8, 1.2), beta=rng.uniform(-20, 20))
+
+
+def encode_jpeg(img):
+    return cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def random_gallery(size, dim=512, per_identity=3, seed=0):
+    """L2-normalized random embeddings clustered per identity, with matching labels and hashes."""
+    rng = np.random.default_rng(seed)
+    n_identities = max(1, size // per_identity)
+    centers = rng.normal(size=(n_identities, dim)).astype(np.float32)
+    owners = np.arange(size) % n_identities
+    embeddings = centers[owners] + 0.3 * rng.normal(size=(size, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    labels = [f"person{owner}_{i}.jpg" for i, owner in enumerate(owners)]
+    hashes = [f"{i:032x}" for i in range(size)]
+    return embeddings, labels, hashes
+
+
+def run_concurrent(fn, payloads, concurrency):
+    """Calls fn(payload) from `concurrency` threads; returns (latencies, elapsed)."""
+    def one(payload):
+        started = time.perf_counter()
+        fn(payload)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one, payloads))
+    return latencies, time.perf_counter() - started
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--gallery-size', type=int, default=1000)
+    parser.add_argument('--source', choices=('random', 'dataset'), default='random',
+                        help="random embeddings, or dataset/ images + augmentation embedded for real")
+    parser.add_argument('--dataset', default='dataset')
+    parser.add_argument('--requests', type=int, default=64, help="predict calls per concurrency level")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--uploads', type=int, default=8, help="upload_data calls")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=None, help="scratch dir (default: a new temp dir)")
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args(argv)
+
+    # Everything main.py touches lives in a scratch dir; GCS is a local folder
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bionicscan-bench-')
+    os.environ['DB_PATH'] = os.path.join(workdir, 'db')
+    os.environ['EMBEDDINGS_DIR'] = os.path.join(workdir, 'embeddings')
+    os.environ['GCS_LOCAL_BUCKET_DIR'] = os.path.join(workdir, 'bucket')
+    os.environ.setdefault('RESULT_CACHE_SIZE', '0')  # measure the pipeline, not the result cache
+
+    rng = np.random.default_rng(args.seed)
+    sources = dataset_images(args.dataset)
+    if not sources:
+        raise SystemExit(f"No images found under {args.dataset}/<person>/")
+
+    started = time.perf_counter()
+    import main as app
+    import_seconds = time.perf_counter() - started
+
+    timer = StageTimer()
+    started = time.perf_counter()
+    app.warm_models()
+    warmup_seconds = time.perf_counter() - started
+
+    app.decode_image = timer.wrap('decode', app.decode_image)
+    app.face_detector.detect = timer.wrap('detect', app.face_detector.detect)
+    app.embedding_batcher.embed = timer.wrap('embed', app.embedding_batcher.embed)
+    app.gallery.match_many = timer.wrap('search', app.gallery.match_many)
+    app.sync_db_from_gcs = timer.wrap('sync_download', app.sync_db_from_gcs)
+    app.commit_gallery_file = timer.wrap('gallery_file_write', app.commit_gallery_file)
+    sync = timer.wrap('sync', app.sync_and_refresh)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "config": {
+            **vars(args),
+            "workdir": workdir,
+            "model": app.MODEL_NAME,
+            "detector": app.DETECTOR_NAME,
+            "gallery_dtype": app.GALLERY_DTYPE,
+            "search_backend": app.SEARCH_BACKEND,
+            "prototypes": app.GALLERY_PROTOTYPES,
+        },
+        "import_seconds": round(import_seconds, 3),
+        "warmup_seconds": round(warmup_seconds, 3),
+    }
+
+    # 1. Gallery
+    print(f">>> Building {args.source} gallery of {args.gallery_size} faces...")
+    started = time.perf_counter()
+    if args.source == 'random':
+        embeddings, labels, hashes = random_gallery(args.gallery_size, seed=args.seed)
+        app.gallery.load_snapshot(embeddings, labels, hashes)
+        app.publish_gallery_file()
+    else:
+        bucket_dir = os.environ['GCS_LOCAL_BUCKET_DIR']
+        manifest = Manifest()
+        for i in range(args.gallery_size):
+            person, img = sources[i % len(sources)]
+            contents = encode_jpeg(augment(img, rng) if i >= len(sources) else img)
+            name, obj, _ = enrollment_entry(person, f"{i}.jpg", contents)
+            write_object(os.path.join(bucket_dir, app.GCS_OBJECTS_PREFIX), obj, contents)
+            manifest.add(name, obj)
+        manifest.save(os.path.join(bucket_dir, app.GCS_MANIFEST_BLOB))
+        sync()
+    results["gallery"] = {
+        "size": len(app.gallery),
+        "identities": app.gallery.identity_count,
+        "build_seconds": round(time.perf_counter() - started, 3),
+        "stages": timer.report(),
+    }
+
+    # 2. Incremental sync with nothing changed (the steady-state background cost);
+    # a random gallery has no images in the bucket, so a sync would empty it
+    if args.source == 'dataset':
+        timer.reset()
+        for _ in range(3):
+            sync()
+        results["sync_noop"] = timer.report()
+
+    # 3. Predict under concurrency
+    probes = [encode_jpeg(augment(img, rng)) for _, img in sources]
+    results["predict"] = []
+    for concurrency in args.concurrency:
+        timer.reset()
+        payloads = [probes[i % len(probes)] for i in range(args.requests)]
+        latencies, elapsed = run_concurrent(app.identify_face, payloads, concurrency)
+        results["predict"].append({
+            "concurrency": concurrency,
+            "throughput_rps": round(len(payloads) / elapsed, 2),
+            "latency": percentiles(latencies),
+            "stages": timer.report(),
+        })
+        print(f">>> predict x{concurrency}: {len(payloads) / elapsed:.1f} req/s")
+
+    # 4. Upload (enroll one image at a time, each a full gallery commit)
+    timer.reset()
+    uploads = []
+    for i in range(args.uploads):
+        person, img = sources[i % len(sources)]
+        uploads.append((encode_jpeg(augment(img, rng)), f"bench_{i}.jpg", person))
+    latencies, elapsed = run_concurrent(lambda upload: app.enroll_face(*upload), uploads, 1)
+    results["upload"] = {"latency": percentiles(latencies), "stages": timer.report()}
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    app.inference_pool.shutdown()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps({k: results[k] for k in ("commit", "import_seconds", "warmup_seconds", "peak_rss_mb")}))
+    print(f">>> Results written to {args.output}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
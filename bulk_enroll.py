@@ -0,0 +1,136 @@
+import os
+import json
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from gallery import IMAGE_EXTENSIONS
+from content_store import enrollment_entry, object_hash, write_object
+from image_io import decode_image
+
+MANIFEST_NAMES = ('manifest.json',)
+
+
+def _is_image(path):
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _read(read_fn):
+    """Member bytes, or the exception so it is reported against that item only."""
+    try:
+        return read_fn()
+    except Exception as e:
+        return e
+
+
+def iter_archive(fileobj, manifest=None):
+    """
+    Yields (source, name, contents) for every image in a zip archive, one
+    member at a time. The name comes from `manifest` ({path: name}), then
+    from a manifest.json inside the archive, then from the member's folder
+    ('Jane Doe/photo1.jpg'); it is None when none of those apply.
+    """
+    with zipfile.ZipFile(fileobj) as archive:
+        manifest = dict(manifest or {})
+        for member in MANIFEST_NAMES:
+            if member in archive.namelist():
+                manifest = {**json.loads(archive.read(member)), **manifest}
+        for info in archive.infolist():
+            if info.is_dir() or not _is_image(info.filename) or '__MACOSX' in info.filename:
+                continue
+            folder = os.path.basename(os.path.dirname(info.filename))
+            name = manifest.get(info.filename) or manifest.get(os.path.basename(info.filename)) or folder or None
+            yield info.filename, name, _read(lambda: archive.read(info))
+
+
+def iter_uploads(uploads, manifest=None):
+    """Yields (source, name, contents) for (filename, file object) pairs of a multipart upload."""
+    manifest = manifest or {}
+    for filename, fileobj in uploads:
+        yield filename, manifest.get(filename), _read(fileobj.read)
+
+
+class BulkEnrollment:
+    """
+    Streaming bulk-enrollment pipeline.
+
+    Items are consumed in batches of `batch_size`: each batch is read,
+    hashed, decoded and run through face detection, then all of its crops
+    go through a single batched embedding call. Accepted images are stored
+    by content hash in `image_dir` (see content_store.py), their embeddings
+    go into `cache` (so a concurrent cloud sync does not embed them again)
+    and the objects are handed to a thread pool for upload while the next
+    batch is processed. Nothing touches the manifest or the gallery here;
+    the caller commits every enrolled item at once.
+    """
+
+    def __init__(self, image_dir, detect_fn, embed_fn, cache, upload_fn=None, known_fn=None,
+                 batch_size=16, upload_workers=8):
+        self.image_dir = image_dir
+        self.cache = cache
+        self.detect_fn = detect_fn
+        self.embed_fn = embed_fn
+        self.upload_fn = upload_fn
+        self.known_fn = known_fn or (lambda content_hash: content_hash in cache)
+        self.batch_size = max(1, batch_size)
+        self.upload_workers = upload_workers
+
+    def run(self, items):
+        """One result dict per item, in input order ('enrolled' or 'failed' + error)."""
+        results, uploads = [], []
+        with ThreadPoolExecutor(max_workers=self.upload_workers, thread_name_prefix="bulk-upload") as pool:
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) == self.batch_size:
+                    self._process(batch, results, uploads, pool)
+                    batch = []
+            if batch:
+                self._process(batch, results, uploads, pool)
+
+            for result, future in uploads:
+                try:
+                    future.result()
+                except Exception as e:
+                    result.update(status="failed", error=f"Upload failed: {e}")
+        return results
+
+    def _process(self, batch, results, uploads, pool):
+        accepted, crops = [], []
+        for source, name, contents in batch:
+            result = {"source": source, "name": name, "filename": None, "status": "failed", "error": None}
+            results.append(result)
+            try:
+                if not name:
+                    raise ValueError("No name given (use a manifest or one folder per person).")
+                if isinstance(contents, Exception):
+                    raise contents
+                result["name"], result["object"], result["filename"] = enrollment_entry(name, source, contents)
+                result["content_hash"] = object_hash(result["object"])
+                if self.known_fn(result["content_hash"]):
+                    # Same bytes already embedded: no detection or embedding needed
+                    accepted.append((result, contents, None))
+                    continue
+                faces = self.detect_fn(decode_image(contents))
+                if not faces:
+                    raise ValueError("No face detected.")
+                accepted.append((result, contents, len(crops)))
+                crops.append(faces[0][0])
+            except Exception as e:
+                result["error"] = str(e)
+
+        vectors = None
+        if crops:
+            try:
+                vectors = np.asarray(self.embed_fn(crops))
+            except Exception as e:
+                for result, _, crop_row in accepted:
+                    if crop_row is not None:
+                        result["error"] = f"Embedding failed: {e}"
+                accepted = [entry for entry in accepted if entry[2] is None]
+        for result, contents, crop_row in accepted:
+            if crop_row is not None:
+                self.cache.put(result["content_hash"], vectors[crop_row])
+            local_path = write_object(self.image_dir, result["object"], contents)
+            result["status"] = "enrolled"
+            if self.upload_fn:
+                uploads.append((result, pool.submit(self.upload_fn, result["object"], local_path)))
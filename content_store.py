@@ -0,0 +1,131 @@
+import os
+import json
+import hashlib
+from gallery import IMAGE_EXTENSIONS, list_images
+
+MANIFEST_FORMAT = 1
+MANIFEST_FILENAME = 'manifest.json'
+OBJECTS_DIR = 'objects'
+
+
+def safe_identity_name(name):
+    """Name as stored in the manifest: letters, digits and spaces only."""
+    return "".join([c for c in name if c.isalpha() or c.isdigit() or c == ' ']).strip()
+
+
+def object_name(content_hash, original_filename=''):
+    """Content-addressed object name: '<md5><ext>' (.jpg when the upload has no image extension)."""
+    ext = os.path.splitext(original_filename)[1].lower()
+    return f"{content_hash}{ext if ext in IMAGE_EXTENSIONS else '.jpg'}"
+
+
+def object_hash(obj):
+    return os.path.splitext(obj)[0]
+
+
+def object_label(name, obj):
+    """Gallery label of an enrolled image: '<name>_<object>' (parse_identity_name gives the name back)."""
+    return f"{name}_{obj}"
+
+
+def label_object(label):
+    """Object behind a gallery label (an md5 never contains '_')."""
+    return label.rsplit('_', 1)[-1]
+
+
+def enrollment_entry(name, original_filename, contents):
+    """(safe name, object name, gallery label) for uploaded image bytes."""
+    safe_name = safe_identity_name(name)
+    if not safe_name:
+        raise ValueError("The name must contain letters or digits.")
+    obj = object_name(hashlib.md5(contents).hexdigest(), original_filename)
+    return safe_name, obj, object_label(safe_name, obj)
+
+
+def write_object(objects_dir, obj, contents):
+    """Store image bytes under their object name; a no-op if that content is already stored."""
+    path = os.path.join(objects_dir, obj)
+    if not os.path.exists(path):
+        os.makedirs(objects_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.part"
+        with open(tmp_path, 'wb') as f:
+            f.write(contents)
+        os.replace(tmp_path, path)
+    return path
+
+
+class Manifest:
+    """
+    Who is enrolled: person name -> object names ('<md5><ext>').
+
+    Image bytes are stored once per content under objects/, so the same
+    photo uploaded twice, or under two names, costs one object and one
+    embedding, and two different photos can never overwrite each other.
+    The manifest is the source of truth for the gallery: syncing means
+    comparing manifests, not listing every stored image.
+    """
+
+    def __init__(self, names=None):
+        self.names = {name: sorted(set(objects)) for name, objects in (names or {}).items() if objects}
+
+    @classmethod
+    def from_bytes(cls, data):
+        doc = json.loads(data)
+        if doc.get("format") != MANIFEST_FORMAT:
+            raise ValueError(f"Unsupported manifest format: {doc.get('format')}")
+        return cls(doc["names"])
+
+    def to_bytes(self):
+        return json.dumps({"format": MANIFEST_FORMAT, "names": self.names}, indent=1, sort_keys=True).encode()
+
+    @classmethod
+    def load(cls, path):
+        """The manifest at path (empty if there is none yet)."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.to_bytes())
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return sum(len(objects) for objects in self.names.values())
+
+    def add(self, name, obj):
+        """Enroll obj under name. Returns False if it already was."""
+        objects = self.names.setdefault(name, [])
+        if obj in objects:
+            return False
+        objects.append(obj)
+        objects.sort()
+        return True
+
+    def objects(self):
+        return {obj for objects in self.names.values() for obj in objects}
+
+    def entries(self):
+        """{gallery label: content hash} for every enrolled image."""
+        return {object_label(name, obj): object_hash(obj) for name, objects in self.names.items() for obj in objects}
+
+
+def import_legacy_files(image_dir, manifest, name_fn):
+    """
+    Move images written flat into image_dir ('Jane_Doe_photo.jpg', the
+    layout before the content store) into image_dir/objects and name them in
+    manifest with name_fn(filename). Returns how many entries were added.
+    """
+    objects_dir = os.path.join(image_dir, OBJECTS_DIR)
+    added = 0
+    for filename in list_images(image_dir):
+        path = os.path.join(image_dir, filename)
+        with open(path, 'rb') as f:
+            obj = object_name(hashlib.md5(f.read()).hexdigest(), filename)
+        os.makedirs(objects_dir, exist_ok=True)
+        os.replace(path, os.path.join(objects_dir, obj))
+        added += manifest.add(safe_identity_name(name_fn(filename)), obj)
+    return added
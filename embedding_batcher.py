@@ -0,0 +1,136 @@
+import time
+import queue
+import threading
+import numpy as np
+
+
+class _Job:
+    def __init__(self, crops):
+        self.crops = crops
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batching scheduler for face embeddings.
+
+    Callers (inference pool threads) hand in preprocessed face crops and
+    block; a single worker collects crops for up to `max_wait_ms` or until
+    `max_batch_size` crops are waiting, runs one batched forward pass and
+    scatters the rows back to each caller.
+    """
+
+    def __init__(self, embed_batch_fn, max_batch_size=8, max_wait_ms=5.0):
+        self.embed_batch_fn = embed_batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def mean_batch_size(self):
+        return self.items / self.batches if self.batches else 0.0
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def embed(self, crops):
+        """Embeddings for a list of (1, H, W, 3) crops, shape (len(crops), D)."""
+        if len(crops) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        self.start()
+        job = _Job(list(crops))
+        self._queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _collect(self):
+        jobs = [self._queue.get()]
+        size = len(jobs[0].crops)
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            jobs.append(job)
+            size += len(job.crops)
+        return jobs
+
+    def _loop(self):
+        while True:
+            jobs = self._collect()
+            crops = [crop for job in jobs for crop in job.crops]
+            try:
+                embeddings = np.asarray(self.embed_batch_fn(np.concatenate(crops, axis=0)), dtype=np.float32)
+                start = 0
+                for job in jobs:
+                    job.result = embeddings[start:start + len(job.crops)]
+                    start += len(job.crops)
+            except Exception as e:
+                for job in jobs:
+                    job.error = e
+            self.batches += 1
+            self.items += len(crops)
+            for job in jobs:
+                job.done.set()
+
+
+def benchmark_batcher(embed_batch_fn, crop, settings, concurrency=8, requests=64):
+    """
+    Throughput vs latency for each (max_batch_size, max_wait_ms) setting,
+    driving the batcher from `concurrency` threads with one crop per request.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    results = []
+    for max_batch_size, max_wait_ms in settings:
+        batcher = EmbeddingBatcher(embed_batch_fn, max_batch_size, max_wait_ms)
+        batcher.embed([crop])  # warm-up
+
+        def one_request(_):
+            started = time.perf_counter()
+            batcher.embed([crop])
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = sorted(pool.map(one_request, range(requests)))
+        elapsed = time.perf_counter() - started
+        results.append({
+            "max_batch_size": max_batch_size,
+            "max_wait_ms": max_wait_ms,
+            "throughput_rps": round(requests / elapsed, 2),
+            "p50_ms": round(1000 * latencies[len(latencies) // 2], 2),
+            "p95_ms": round(1000 * latencies[int(len(latencies) * 0.95) - 1], 2),
+            "mean_batch_size": round(batcher.mean_batch_size, 2),
+        })
+    return results
+
+
+if __name__ == '__main__':
+    import json
+    from deepface import DeepFace
+
+    model = DeepFace.build_model('ArcFace')
+    dummy_crop = np.random.rand(1, 112, 112, 3).astype(np.float32)
+    sweep = [(1, 0), (4, 2), (8, 5), (16, 10), (32, 20)]
+    for row in benchmark_batcher(lambda batch: model.predict(batch, verbose=0), dummy_crop, sweep):
+        print(json.dumps(row))
@@ -0,0 +1,109 @@
+import os
+import logging
+import hashlib
+import threading
+import numpy as np
+
+logger = logging.getLogger("EmbeddingCache")
+
+
+def file_md5(path, chunk_size=1 << 20):
+    """Hex md5 of a file's content (same digest GCS keeps for each blob)."""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent content-hash -> embedding store.
+
+    Entries are keyed by the md5 of the image bytes, so a renamed or
+    re-synced file is never embedded twice. The cache is written as a single
+    .npz next to (not inside) the face DB and survives restarts. It is only
+    read from disk on first use, since serving never needs it.
+    """
+
+    def __init__(self, path, model_name='ArcFace'):
+        self.path = path
+        self.model_name = model_name
+        self._entries = {}
+        self._dirty = False
+        self._loaded = False
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+                    self._loaded = True
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            self._mtime = os.path.getmtime(self.path)
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data['model_name']) != self.model_name:
+                    logger.info(f">>> Embedding cache built for {data['model_name']}, ignoring it.")
+                    return
+                for h, vec in zip(data['hashes'], data['embeddings']):
+                    self._entries.setdefault(str(h), vec)
+            logger.info(f">>> Loaded {len(self._entries)} cached embeddings from {self.path}")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read embedding cache {self.path}: {e}")
+
+    def refresh(self):
+        """Merge in entries another process saved since this one last read or wrote the file."""
+        self._ensure_loaded()
+        with self._lock:
+            if os.path.exists(self.path) and os.path.getmtime(self.path) != self._mtime:
+                self._load()
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._entries)
+
+    def __contains__(self, content_hash):
+        self._ensure_loaded()
+        return content_hash in self._entries
+
+    def get(self, content_hash):
+        self._ensure_loaded()
+        return self._entries.get(content_hash)
+
+    def put(self, content_hash, embedding):
+        self._ensure_loaded()
+        with self._lock:
+            self._entries[content_hash] = np.asarray(embedding, dtype=np.float32)
+            self._dirty = True
+
+    def retain(self, content_hashes):
+        """Drop every entry whose hash is not in content_hashes."""
+        self._ensure_loaded()
+        keep = set(content_hashes)
+        with self._lock:
+            stale = [h for h in self._entries if h not in keep]
+            for h in stale:
+                del self._entries[h]
+            if stale:
+                self._dirty = True
+
+    def save(self):
+        """Atomically write the cache to disk if it changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            hashes = list(self._entries)
+            embeddings = np.vstack([self._entries[h] for h in hashes]) if hashes else np.zeros((0, 0), dtype=np.float32)
+            self._dirty = False
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, model_name=self.model_name, hashes=np.array(hashes, dtype=str), embeddings=embeddings)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.path.getmtime(self.path)
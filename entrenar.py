@@ -6,11 +6,13 @@ os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2' 
 
 import json
+import time
+import hashlib
+import argparse
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 
 
 print(f"Dispositivos disponibles: {tf.config.list_physical_devices()}")
@@ -23,46 +25,129 @@ LABELS_FILENAME = os.path.join(BASE_DIR, 'etiquetas.json')
 IMG_SIZE = (224, 224)
 BATCH_SIZE = 16  # Reducido a 16 para no saturar la CPU/RAM
 EPOCHS = 10 
+VALIDATION_SPLIT = 0.2
+SEED = 123
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+# Caché de imágenes ya decodificadas y redimensionadas (se llena en la 1ª época y se reutiliza
+# entre ejecuciones mientras el dataset no cambie). Vacío = caché en memoria.
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(BASE_DIR, '.cache_entrenamiento'))
+AUTOTUNE = tf.data.AUTOTUNE
+
+# --- MODO CABEZA: clasificador ligero sobre la galería de main.py (todas las altas, con sus nombres) ---
+HEAD_FILENAME = os.path.join(BASE_DIR, 'cabeza_arcface.npz')
+# Fichero de galería del servicio (o el shard publicado en GCS, shards/gallery_arcface.bsg)
+GALLERY_FILE = os.path.join(os.environ.get('EMBEDDINGS_DIR', '/tmp/embeddings'), 'gallery_arcface.bsg')
+HEAD_HIDDEN = int(os.environ.get('HEAD_HIDDEN', '0'))  # 0 = regresión logística; >0 = MLP con esa capa oculta
+HEAD_EPOCHS = 300
+
+
+def listar_dataset(dataset_dir):
+    """
+    Un único recorrido de dataset/<clase>/<imagen>. Devuelve (rutas, índices
+    de clase, nombres de clase); las clases van en orden alfabético, igual que
+    flow_from_directory, para que etiquetas.json siga siendo compatible.
+    """
+    clases = sorted(d for d in os.listdir(dataset_dir) if os.path.isdir(os.path.join(dataset_dir, d)))
+    rutas, etiquetas = [], []
+    for indice, clase in enumerate(clases):
+        carpeta = os.path.join(dataset_dir, clase)
+        for nombre in sorted(os.listdir(carpeta)):
+            if nombre.lower().endswith(IMAGE_EXTENSIONS):
+                rutas.append(os.path.join(carpeta, nombre))
+                etiquetas.append(indice)
+    return rutas, np.array(etiquetas, dtype=np.int32), clases
+
+
+def dividir(rutas, etiquetas, validation_split=VALIDATION_SPLIT, seed=SEED):
+    """
+    Split entrenamiento/validación calculado una sola vez, estratificado por
+    clase (cada clase con al menos 2 imágenes aporta una a validación).
+    """
+    train, val = dividir_indices(etiquetas, validation_split, seed)
+    rutas = np.array(rutas)
+    return (rutas[train], etiquetas[train]), (rutas[val], etiquetas[val])
+
+
+def dividir_indices(etiquetas, validation_split=VALIDATION_SPLIT, seed=SEED):
+    """Índices (entrenamiento, validación) del split estratificado."""
+    rng = np.random.default_rng(seed)
+    train, val = [], []
+    for clase in np.unique(etiquetas):
+        indices = rng.permutation(np.flatnonzero(etiquetas == clase))
+        n_val = max(1, int(round(len(indices) * validation_split))) if len(indices) > 1 else 0
+        val.extend(indices[:n_val])
+        train.extend(indices[n_val:])
+    return np.sort(train).astype(int), np.sort(val).astype(int)
+
+
+def huella_dataset(rutas):
+    """Identifica la lista de ficheros (ruta, tamaño, mtime) para invalidar la caché si cambia."""
+    h = hashlib.md5(f"{IMG_SIZE}".encode())
+    for ruta in rutas:
+        st = os.stat(ruta)
+        h.update(f"{ruta}|{st.st_size}|{st.st_mtime_ns}".encode())
+    return h.hexdigest()[:16]
+
+
+def _decodificar(ruta, etiqueta):
+    # decode_image admite JPEG/PNG/BMP/GIF; expand_animations=False da siempre un tensor 3D
+    imagen = tf.io.decode_image(tf.io.read_file(ruta), channels=3, expand_animations=False)
+    imagen = tf.image.resize(imagen, IMG_SIZE)
+    return tf.cast(tf.round(imagen), tf.uint8), etiqueta
+
+
+def crear_dataset(rutas, etiquetas, num_classes, nombre, entrenamiento):
+    """
+    tf.data: lectura + decodificación + resize en paralelo, una sola vez
+    (cache), luego barajado, lotes, aumentación vectorizada por lote y
+    prefetch para que la CPU nunca espere a la entrada.
+    """
+    ds = tf.data.Dataset.from_tensor_slices((rutas, etiquetas))
+    ds = ds.map(_decodificar, num_parallel_calls=AUTOTUNE, deterministic=False)
+    if CACHE_DIR:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        ds = ds.cache(os.path.join(CACHE_DIR, f"{nombre}_{huella_dataset(rutas)}"))
+    else:
+        ds = ds.cache()
+    if entrenamiento:
+        ds = ds.shuffle(max(1, len(rutas)), seed=SEED, reshuffle_each_iteration=True)
+    ds = ds.batch(BATCH_SIZE)
+
+    # Misma aumentación que antes (rotación ±15°, espejo horizontal), aplicada al lote entero
+    aumentacion = tf.keras.Sequential([
+        tf.keras.layers.RandomFlip('horizontal', seed=SEED),
+        tf.keras.layers.RandomRotation(15 / 360, fill_mode='nearest', seed=SEED),
+    ])
+
+    def preparar(imagenes, etiquetas):
+        imagenes = tf.cast(imagenes, tf.float32) / 255.0
+        if entrenamiento:
+            imagenes = aumentacion(imagenes, training=True)
+        return imagenes, tf.one_hot(etiquetas, num_classes)
+
+    ds = ds.map(preparar, num_parallel_calls=AUTOTUNE)
+    return ds.prefetch(AUTOTUNE)
+
 
 def entrenar():
     print(">>> [1/4] Cargando imágenes del dataset (MODO CPU)...")
     
-    # Generador de imágenes 
-    train_datagen = ImageDataGenerator(
-        rescale=1./255,
-        rotation_range=15,      
-        horizontal_flip=True,   
-        validation_split=0.2
-    )
-
+    # Un solo recorrido del dataset y un solo split para entrenamiento y validación
     try:
-        # Cargar datos de entrenamiento
-        train_generator = train_datagen.flow_from_directory(
-            DATASET_DIR,
-            target_size=IMG_SIZE,
-            batch_size=BATCH_SIZE,
-            class_mode='categorical',
-            subset='training'
-        )
-
-        # Cargar datos de validación
-        validation_generator = train_datagen.flow_from_directory(
-            DATASET_DIR,
-            target_size=IMG_SIZE,
-            batch_size=BATCH_SIZE,
-            class_mode='categorical',
-            subset='validation'
-        )
+        rutas, etiquetas, clases = listar_dataset(DATASET_DIR)
     except FileNotFoundError:
         print(f"ERROR: No se encuentra la carpeta '{DATASET_DIR}'. Créala y pon subcarpetas con fotos.")
         return
 
     # Guardar mapa de etiquetas 
-    if train_generator.samples == 0:
+    if len(rutas) == 0:
         print(" ERROR: La carpeta dataset está vacía o mal estructurada.")
         return
 
-    class_map = {v: k for k, v in train_generator.class_indices.items()}
+    (rutas_train, etiquetas_train), (rutas_val, etiquetas_val) = dividir(rutas, etiquetas)
+    print(f">>> {len(rutas_train)} imágenes de entrenamiento, {len(rutas_val)} de validación, {len(clases)} clases")
+
+    class_map = {i: clase for i, clase in enumerate(clases)}
     with open(LABELS_FILENAME, 'w') as f:
         json.dump(class_map, f)
     print(f">>> Etiquetas guardadas: {class_map}")
@@ -95,19 +180,17 @@ def entrenar():
 
     print(f">>> [3/4] Entrenando... Paciencia, esto usa el procesador.")
     
-    validation_data = validation_generator
-    validation_steps = validation_generator.samples // BATCH_SIZE
+    train_ds = crear_dataset(rutas_train, etiquetas_train, num_classes, 'train', entrenamiento=True)
+    validation_data = None
     
-    if validation_generator.samples == 0:
+    if len(rutas_val) == 0:
         print(" AVISO: No hay suficientes imágenes para validación (se requiere > 0). Se omitirá la validación.")
-        validation_data = None
-        validation_steps = None
+    else:
+        validation_data = crear_dataset(rutas_val, etiquetas_val, num_classes, 'val', entrenamiento=False)
     
     model.fit(
-        train_generator,
-        steps_per_epoch=max(1, train_generator.samples // BATCH_SIZE),
+        train_ds,
         validation_data=validation_data,
-        validation_steps=validation_steps,
         epochs=EPOCHS
     )
 
@@ -115,5 +198,86 @@ def entrenar():
     model.save(MODEL_FILENAME)
     print(f"¡LISTO! Modelo guardado en: {MODEL_FILENAME}")
 
+def embeddings_galeria(ruta):
+    """
+    Embeddings ArcFace de la galería del servicio (float32, normalizados),
+    el nombre de cada persona tal como lo devuelve la galería y la huella
+    modelo/detector con la que se calcularon. Incluye todo lo dado de alta
+    por /upload_data/ y /upload_bulk/, sin volver a detectar ni embeber.
+    """
+    from gallery import l2_normalize, parse_identity_name
+    from gallery_shard import read_shard
+    from quantization import dequantize
+
+    header, embeddings, scales = read_shard(ruta, mmap=False)
+    nombres = np.array([parse_identity_name(label) for label in header["labels"]], dtype=object)
+    if header["count"] == 0:
+        return np.zeros((0, 0), dtype=np.float32), nombres, header
+    return l2_normalize(dequantize(embeddings, scales)), nombres, header
+
+
+def entrenar_cabeza(ruta_galeria=GALLERY_FILE):
+    """
+    Entrena solo una cabeza ligera (regresión logística o MLP pequeño) sobre
+    los embeddings de la galería y la exporta a HEAD_FILENAME (.npz que
+    main.py carga con NumPy, sin TensorFlow). Reentrenar tras nuevas altas
+    tarda segundos. main.py solo acepta su respuesta si la galería la
+    confirma (distancia a esa persona bajo el umbral).
+    """
+    from face_head import EmbeddingHead
+
+    inicio = time.perf_counter()
+    print(f">>> [1/3] Leyendo embeddings de la galería {ruta_galeria}...")
+    if not os.path.exists(ruta_galeria):
+        print(f"ERROR: No existe '{ruta_galeria}'. Arranca el servicio (o descarga el shard publicado) primero.")
+        return
+    X, nombres, header = embeddings_galeria(ruta_galeria)
+    clases, y = np.unique(nombres.astype(str), return_inverse=True)
+    if len(clases) < 2:
+        print(" ERROR: La galería necesita al menos dos personas.")
+        return
+    y = y.astype(np.int32)
+    train, val = dividir_indices(y)
+    print(f">>> {len(train)} embeddings de entrenamiento, {len(val)} de validación, {len(clases)} clases")
+
+    print(f">>> [2/3] Entrenando cabeza ({'MLP ' + str(HEAD_HIDDEN) if HEAD_HIDDEN else 'logística'})...")
+    capas = [Dense(HEAD_HIDDEN, activation='relu'), Dropout(0.2)] if HEAD_HIDDEN else []
+    model = Sequential([tf.keras.Input(shape=(X.shape[1],)), *capas, Dense(len(clases), activation='softmax')])
+    model.compile(optimizer=tf.keras.optimizers.Adam(1e-2), loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    monitor = 'val_loss' if len(val) else 'loss'
+    model.fit(
+        X[train], y[train],
+        validation_data=(X[val], y[val]) if len(val) else None,
+        epochs=HEAD_EPOCHS,
+        batch_size=64,
+        verbose=0,
+        callbacks=[tf.keras.callbacks.EarlyStopping(monitor=monitor, patience=20, restore_best_weights=True)]
+    )
+    if len(val):
+        _, precision = model.evaluate(X[val], y[val], verbose=0)
+        print(f">>> Precisión en validación: {precision:.2%}")
+
+    print(">>> [3/3] Exportando cabeza...")
+    # Huella del servicio: "ArcFace|<detector>|align=True|deepface-x|<runtime>"
+    partes = header["fingerprint"].split('|')
+    densas = [capa for capa in model.layers if isinstance(capa, Dense)]
+    head = EmbeddingHead([capa.get_weights() for capa in densas], clases,
+                         activation='relu' if HEAD_HIDDEN else 'linear',
+                         model_name=header["model_name"] or partes[0], detector=partes[1] if len(partes) > 1 else None)
+    head.save(HEAD_FILENAME)
+    # Comprobación: la cabeza en NumPy debe dar lo mismo que Keras
+    diferencia = np.abs(head.probabilities(X[:64]) - model.predict(X[:64], verbose=0)).max()
+    print(f">>> Diferencia NumPy vs Keras: {diferencia:.2e}")
+    print(f"¡LISTO! Cabeza guardada en: {HEAD_FILENAME} ({time.perf_counter() - inicio:.1f}s)")
+
+
 if __name__ == '__main__':
-    entrenar()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Entrenamiento del clasificador de BionicScan")
+    parser.add_argument('--modo', choices=('cnn', 'cabeza'), default='cnn',
+                        help="cnn: red convolucional desde cero; cabeza: clasificador sobre embeddings ArcFace")
+    parser.add_argument('--galeria', default=GALLERY_FILE, help="fichero de galería para --modo cabeza")
+    args = parser.parse_args()
+    if args.modo == 'cabeza':
+        entrenar_cabeza(args.galeria)
+    else:
+        entrenar()
\ No newline at end of file
@@ -0,0 +1,144 @@
+import os
+
+# --- BLOQUE CRÍTICO PARA CPU ---
+os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+
+# --- CONFIGURACIÓN ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_DIR = os.path.join(BASE_DIR, 'dataset')
+CNN_FILENAME = os.path.join(BASE_DIR, 'modelo_entrenado.h5')
+EXPORT_DIR = os.path.join(BASE_DIR, 'exportados')
+MODEL_NAME = 'ArcFace'
+DETECTOR_BACKEND = os.environ.get('DETECTOR_BACKEND', 'ssd')
+N_REPRESENTATIVAS = 100  # muestras para calibrar la cuantización int8
+# Paridad mínima exigida frente al modelo original
+MIN_COSENO = {'float32': 0.999, 'int8': 0.98}  # ArcFace: coseno entre embeddings
+MIN_ACUERDO_TOP1 = {'float32': 1.0, 'int8': 0.95}  # CNN: misma clase predicha
+
+
+def convertir_tflite(model, ruta, int8=False, representativas=None):
+    """
+    Keras -> TFLite. Con int8=True se aplica cuantización post-entrenamiento
+    completa (pesos y activaciones) calibrada con `representativas`; la
+    entrada y la salida siguen en float32 para que el servicio no cambie.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if int8:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([muestra[None].astype(np.float32)] for muestra in representativas)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    contenido = converter.convert()
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    with open(ruta, 'wb') as f:
+        f.write(contenido)
+    return ruta
+
+
+def recortes_arcface(n):
+    """Caras del dataset preprocesadas igual que en main.py (o ruido si no hay ninguna)."""
+    from deepface.commons import functions
+    from face_detection import make_detector
+    from gallery import list_images
+
+    detector = make_detector(DETECTOR_BACKEND, target_size=functions.find_target_size(MODEL_NAME))
+    recortes = []
+    for raiz, _, _ in os.walk(DATASET_DIR):
+        for nombre in list_images(raiz):
+            caras = detector.detect(os.path.join(raiz, nombre))
+            recortes.extend(cara[0][0] for cara in caras)
+    if not recortes:
+        print(" AVISO: no hay caras en el dataset; se usan entradas aleatorias para calibrar y comparar.")
+        return np.random.default_rng(0).random((n, *functions.find_target_size(MODEL_NAME), 3)).astype(np.float32)
+    recortes = np.stack(recortes)
+    return recortes[np.arange(n) % len(recortes)]
+
+
+def imagenes_cnn(n, img_size):
+    """Imágenes del dataset redimensionadas y escaladas como en entrenar.py."""
+    from entrenar import listar_dataset
+
+    rutas, _, _ = listar_dataset(DATASET_DIR)
+    imagenes = []
+    for ruta in rutas[:n]:
+        imagen = tf.io.decode_image(tf.io.read_file(ruta), channels=3, expand_animations=False)
+        imagenes.append(tf.image.resize(imagen, img_size).numpy() / 255.0)
+    if not imagenes:
+        return np.random.default_rng(0).random((n, *img_size, 3)).astype(np.float32)
+    imagenes = np.stack(imagenes).astype(np.float32)
+    return imagenes[np.arange(n) % len(imagenes)]
+
+
+def paridad(model, ruta_tflite, entradas, tipo, hilos):
+    """Compara las salidas del modelo Keras y del .tflite sobre las mismas entradas."""
+    from tflite_model import TFLiteModel
+
+    tflite = TFLiteModel(ruta_tflite, num_threads=hilos)
+    inicio = time.perf_counter()
+    esperado = np.concatenate([model(entradas[i:i + 16], training=False).numpy() for i in range(0, len(entradas), 16)])
+    ms_keras = 1000 * (time.perf_counter() - inicio) / len(entradas)
+    inicio = time.perf_counter()
+    obtenido = np.concatenate([tflite.predict(entradas[i:i + 16]) for i in range(0, len(entradas), 16)])
+    ms_tflite = 1000 * (time.perf_counter() - inicio) / len(entradas)
+
+    informe = {
+        "max_abs_diff": float(np.abs(esperado - obtenido).max()),
+        "ms_por_muestra_keras": round(ms_keras, 3),
+        "ms_por_muestra_tflite": round(ms_tflite, 3),
+        "tamano_mb": round(os.path.getsize(ruta_tflite) / 1e6, 2),
+    }
+    if tipo == 'arcface':
+        a = esperado / np.linalg.norm(esperado, axis=1, keepdims=True)
+        b = obtenido / np.linalg.norm(obtenido, axis=1, keepdims=True)
+        cosenos = np.sum(a * b, axis=1)
+        informe.update(coseno_min=float(cosenos.min()), coseno_medio=float(cosenos.mean()))
+    else:
+        informe["acuerdo_top1"] = float(np.mean(esperado.argmax(axis=1) == obtenido.argmax(axis=1)))
+    return informe
+
+
+def exportar(tipo, int8=False, hilos=1, salida=None):
+    """Exporta 'arcface' (modelo del servicio) o 'cnn' (modelo_entrenado.h5) y verifica la paridad."""
+    print(f">>> [1/3] Cargando modelo {tipo}...")
+    if tipo == 'arcface':
+        from deepface import DeepFace
+        model = DeepFace.build_model(MODEL_NAME)
+        entradas = recortes_arcface(N_REPRESENTATIVAS)
+    else:
+        model = tf.keras.models.load_model(CNN_FILENAME)
+        entradas = imagenes_cnn(N_REPRESENTATIVAS, tuple(model.input_shape[1:3]))
+
+    precision = 'int8' if int8 else 'float32'
+    salida = salida or os.path.join(EXPORT_DIR, f"{tipo}_{precision}.tflite")
+    print(f">>> [2/3] Convirtiendo a TFLite ({precision})...")
+    convertir_tflite(model, salida, int8=int8, representativas=entradas)
+
+    print(">>> [3/3] Comprobando paridad con el modelo original...")
+    informe = {"modelo": tipo, "precision": precision, "ruta": salida, **paridad(model, salida, entradas, tipo, hilos)}
+    if tipo == 'arcface':
+        informe["ok"] = informe["coseno_min"] >= MIN_COSENO[precision]
+    else:
+        informe["ok"] = informe["acuerdo_top1"] >= MIN_ACUERDO_TOP1[precision]
+    with open(f"{os.path.splitext(salida)[0]}.json", 'w') as f:
+        json.dump(informe, f, indent=2)
+    print(json.dumps(informe, indent=2))
+    print("¡LISTO!" if informe["ok"] else " ERROR: la paridad no alcanza el mínimo exigido.")
+    return informe
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Exporta los modelos a TFLite para inferencia en CPU")
+    parser.add_argument('modelo', choices=('arcface', 'cnn'))
+    parser.add_argument('--int8', action='store_true', help="cuantización post-entrenamiento int8")
+    parser.add_argument('--hilos', type=int, default=1, help="hilos del intérprete TFLite en la comparación")
+    parser.add_argument('--salida', default=None)
+    args = parser.parse_args()
+    informe = exportar(args.modelo, int8=args.int8, hilos=args.hilos, salida=args.salida)
+    sys.exit(0 if informe["ok"] else 1)
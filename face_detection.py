@@ -0,0 +1,199 @@
+import time
+import threading
+import numpy as np
+
+# Fast-stage acceptance threshold per backend, in that backend's own score
+# units. The CNN detectors (ssd, mediapipe, mtcnn, retinaface) give
+# probabilities in [0, 1], but deepface passes through Haar ('opencv')
+# cascade level weights and dlib SVM margins, which are not capped at 1, so
+# a 0.9 cut-off would accept nearly every hit. Calibrate with
+# `python face_detection.py <dir>` (mean_confidence per backend).
+FAST_MIN_CONFIDENCE = {'opencv': 4.0, 'dlib': 1.0}
+DEFAULT_MIN_CONFIDENCE = 0.9
+
+
+def default_min_confidence(backend):
+    return FAST_MIN_CONFIDENCE.get(backend, DEFAULT_MIN_CONFIDENCE)
+
+
+# DeepFace builds each backend once and shares it (a cv2.dnn_Net for SSD, one
+# CascadeClassifier for Haar): two threads in it at once can swap inputs or
+# crash OpenCV, so detection on a backend is serialized.
+_backend_locks = {}
+_backend_locks_guard = threading.Lock()
+
+
+def _backend_lock(backend):
+    with _backend_locks_guard:
+        return _backend_locks.setdefault(backend, threading.Lock())
+
+
+class DeepFaceDetector:
+    """
+    One DeepFace detector backend ('ssd', 'opencv' (Haar),
+    'mediapipe', 'mtcnn', 'retinaface', ...). Crops are detected, aligned
+    and preprocessed exactly like DeepFace.represent. An image without a
+    face yields an empty list instead of the whole image.
+
+    One detection per backend runs at a time (the embedding forward pass
+    stays parallel); a cascade's two stages do not block each other.
+    """
+
+    def __init__(self, backend, target_size=(112, 112), align=True):
+        self.backend = backend
+        self.target_size = target_size
+        self.align = align
+        self._lock = _backend_lock(backend)
+
+    @property
+    def name(self):
+        return self.backend
+
+    def stats(self):
+        return {"detector": self.name}
+
+    def warm(self):
+        """Build the backend once (DeepFace keeps it in a module-level cache)."""
+        from deepface.detectors import FaceDetector
+        return FaceDetector.build_model(self.backend)
+
+    def detect(self, img):
+        """[(crop, facial_area, confidence)] for img (file path or BGR array), best first."""
+        from deepface.commons import functions
+
+        try:
+            with self._lock:
+                faces = functions.extract_faces(
+                    img=img,
+                    target_size=self.target_size,
+                    detector_backend=self.backend,
+                    grayscale=False,
+                    enforce_detection=True,
+                    align=self.align
+                )
+        except ValueError as e:
+            if "could not be detected" in str(e):
+                return []
+            raise
+        return sorted(faces, key=lambda face: face[2] or 0, reverse=True)
+
+
+class CascadeDetector:
+    """
+    Cheap detector first, heavy detector only when needed.
+
+    The fast stage (e.g. Haar or MediaPipe) answers whenever its best face
+    scores at least `min_confidence` (in the fast backend's score units,
+    see FAST_MIN_CONFIDENCE); otherwise the image is escalated to
+    the slow stage (e.g. SSD). With `escalate_empty=False` an image where
+    the fast stage finds nothing is reported as faceless right away.
+    """
+
+    def __init__(self, fast, slow, min_confidence=0.9, escalate_empty=True):
+        self.fast = fast
+        self.slow = slow
+        self.min_confidence = min_confidence
+        self.escalate_empty = escalate_empty
+        self.fast_accepted = 0
+        self.escalated = 0
+        self.short_circuited = 0  # fast stage found nothing and escalate_empty is off
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return f"{self.fast.name}>{self.slow.name}"
+
+    def warm(self):
+        self.fast.warm()
+        self.slow.warm()
+
+    def detect(self, img):
+        faces = self.fast.detect(img)
+        if faces and (faces[0][2] or 0) >= self.min_confidence:
+            with self._lock:
+                self.fast_accepted += 1
+            return faces
+        if not faces and not self.escalate_empty:
+            with self._lock:
+                self.short_circuited += 1
+            return []
+        with self._lock:
+            self.escalated += 1
+        return self.slow.detect(img)
+
+    def stats(self):
+        total = self.fast_accepted + self.escalated + self.short_circuited
+        return {
+            "detector": self.name,
+            "min_confidence": self.min_confidence,
+            "fast_accepted": self.fast_accepted,
+            "escalated": self.escalated,
+            "short_circuited": self.short_circuited,
+            "escalation_rate": round(self.escalated / total, 4) if total else 0.0,
+        }
+
+
+def make_detector(backend='ssd', fast_backend=None, min_confidence=None, escalate_empty=True,
+                  target_size=(112, 112), align=True):
+    """
+    A single backend, or a fast->slow cascade when fast_backend is set
+    (min_confidence=None uses the fast backend's default threshold).
+    """
+    slow = DeepFaceDetector(backend, target_size, align)
+    if not fast_backend or fast_backend == backend:
+        return slow
+    fast = DeepFaceDetector(fast_backend, target_size, align)
+    if min_confidence is None:
+        min_confidence = default_min_confidence(fast_backend)
+    return CascadeDetector(fast, slow, min_confidence=min_confidence, escalate_empty=escalate_empty)
+
+
+def benchmark_detectors(detectors, images):
+    """
+    Per-detector latency and detection rate over the same images, so the
+    speed/recall tradeoff of each backend (or cascade) can be compared.
+    """
+    results = []
+    for detector in detectors:
+        detector.warm()
+        detector.detect(images[0])  # warm-up
+        latencies, found, confidences = [], 0, []
+        for img in images:
+            started = time.perf_counter()
+            faces = detector.detect(img)
+            latencies.append(time.perf_counter() - started)
+            if faces:
+                found += 1
+                confidences.append(float(faces[0][2] or 0))
+        latencies.sort()
+        row = {
+            "detector": detector.name,
+            "images": len(images),
+            "face_rate": round(found / len(images), 4),
+            "mean_confidence": round(float(np.mean(confidences)), 4) if confidences else None,
+            "mean_ms": round(1000 * float(np.mean(latencies)), 2),
+            "p50_ms": round(1000 * latencies[len(latencies) // 2], 2),
+            "p95_ms": round(1000 * latencies[max(0, int(len(latencies) * 0.95) - 1)], 2),
+        }
+        if isinstance(detector, CascadeDetector):
+            row.update(detector.stats())
+        results.append(row)
+    return results
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import json
+    import cv2
+    from gallery import list_images
+
+    # python face_detection.py <image dir> [backend or fast>slow ...]
+    image_dir = sys.argv[1] if len(sys.argv) > 1 else 'dataset'
+    specs = sys.argv[2:] or ['opencv', 'mediapipe', 'ssd', 'opencv>ssd', 'mediapipe>ssd']
+    paths = [os.path.join(root, f) for root, _, _ in os.walk(image_dir) for f in list_images(root)]
+    images = [img for img in (cv2.imread(p) for p in paths) if img is not None]
+    detectors = [make_detector(spec.split('>')[-1], fast_backend=spec.split('>')[0] if '>' in spec else None)
+                 for spec in specs]
+    for row in benchmark_detectors(detectors, images):
+        print(json.dumps(row))
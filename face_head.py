@@ -0,0 +1,57 @@
+import os
+import numpy as np
+
+HEAD_ACTIVATIONS = ('linear', 'relu')
+
+
+class EmbeddingHead:
+    """
+    Small classifier trained by `entrenar.py --modo cabeza` on top of the
+    serving ArcFace embeddings (softmax regression or a one-hidden-layer
+    MLP). Stored as a plain .npz so serving needs only NumPy:
+    weights W0, b0[, W1, b1], class names and the embedding setup
+    (model + detector) it was trained with.
+    """
+
+    def __init__(self, weights, classes, activation='relu', model_name='ArcFace', detector=None):
+        if activation not in HEAD_ACTIVATIONS:
+            raise ValueError(f"Unknown head activation: {activation}")
+        self.weights = [(np.asarray(W, dtype=np.float32), np.asarray(b, dtype=np.float32)) for W, b in weights]
+        self.classes = [str(c) for c in classes]
+        self.activation = activation
+        self.model_name = model_name
+        self.detector = detector
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            n_layers = int(data["n_layers"])
+            weights = [(data[f"W{i}"], data[f"b{i}"]) for i in range(n_layers)]
+            return cls(weights, data["classes"], str(data["activation"]),
+                       model_name=str(data["model_name"]), detector=str(data["detector"]) or None)
+
+    def save(self, path):
+        arrays = {}
+        for i, (W, b) in enumerate(self.weights):
+            arrays[f"W{i}"], arrays[f"b{i}"] = W, b
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, n_layers=len(self.weights), classes=np.array(self.classes, dtype=str),
+                 activation=self.activation, model_name=self.model_name, detector=self.detector or '', **arrays)
+        os.replace(tmp_path, path)
+
+    def probabilities(self, embeddings):
+        """Class probabilities for one L2-normalized embedding (or a matrix of them)."""
+        x = np.asarray(embeddings, dtype=np.float32)
+        for i, (W, b) in enumerate(self.weights):
+            x = x @ W + b
+            if i < len(self.weights) - 1 and self.activation == 'relu':
+                x = np.maximum(x, 0)
+        x = x - x.max(axis=-1, keepdims=True)
+        e = np.exp(x)
+        return e / e.sum(axis=-1, keepdims=True)
+
+    def predict(self, embedding):
+        """(class name, probability) of the most likely class."""
+        probs = self.probabilities(embedding)
+        best = int(np.argmax(probs))
+        return self.classes[best], float(probs[best])
@@ -0,0 +1,378 @@
+import os
+import logging
+import time
+import threading
+import numpy as np
+from embedding_cache import file_md5
+from search_index import BruteForceIndex, recall_at_1, sample_queries
+from quantization import cosine_scores, dequantize
+
+logger = logging.getLogger("Gallery")
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+PROTOTYPE_MODES = ('image', 'mean', 'kmedoids')
+
+
+def l2_normalize(x):
+    """Row-wise L2 normalization (works for a single vector or a matrix)."""
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def list_images(db_path):
+    """Sorted list of image filenames inside db_path."""
+    if not os.path.exists(db_path):
+        return []
+    return sorted(f for f in os.listdir(db_path) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def parse_identity_name(filename):
+    """Person name from an enrolled filename (e.g. "Vladimir_Putin_db.jpg" -> "Vladimir Putin")."""
+    base = os.path.splitext(os.path.basename(filename))[0]
+    if base.endswith("_db_image"):
+        name = base[:-9]
+    elif base.endswith("_db"):
+        name = base[:-3]
+    else:
+        parts = base.rsplit('_', 1)
+        name = parts[0] if len(parts) > 1 else base
+    return name.replace("_", " ").strip()
+
+
+def _kmedoids(rows, k, iters=5):
+    """Up to k medoid rows (cosine) of one identity's embeddings."""
+    if len(rows) <= k:
+        return rows
+    sims = rows @ rows.T
+    medoids = [int(np.argmax(sims.sum(axis=1)))]
+    while len(medoids) < k:
+        medoids.append(int(np.argmin(sims[:, medoids].max(axis=1))))
+    for _ in range(iters):
+        assignments = np.argmax(sims[:, medoids], axis=1)
+        updated = []
+        for c, medoid in enumerate(medoids):
+            members = np.flatnonzero(assignments == c)
+            if len(members) == 0:
+                updated.append(medoid)
+                continue
+            updated.append(int(members[np.argmax(sims[np.ix_(members, members)].sum(axis=1))]))
+        if updated == medoids:
+            break
+        medoids = updated
+    return rows[medoids]
+
+
+class GallerySnapshot:
+    """
+    Immutable view of the gallery. Updates build a new one and swap it in.
+
+    Besides the per-image rows it carries an identity table: every row maps
+    to one person (`row_identity`), and each person has one or a few
+    `prototypes` that the search index runs over.
+
+    Rows are float32, or float16/int8 (plus per-row `scales`) when the
+    snapshot was memory-mapped from a quantized gallery file.
+    """
+
+    def __init__(self, embeddings, labels, hashes, names, version, scales=None):
+        embeddings = np.asarray(embeddings)
+        if embeddings.dtype not in (np.float16, np.int8):
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.embeddings = embeddings
+        self.scales = scales
+        self.labels = np.array(labels, dtype=object)
+        self.hashes = np.array(hashes, dtype=object)
+        self.names = np.array(names, dtype=object)
+        self.version = version
+        self.created_at = time.time()
+
+        identity_names, row_identity = np.unique(np.array(names, dtype=str), return_inverse=True) if len(names) else ([], [])
+        self.identity_names = np.array(identity_names, dtype=object)
+        self.row_identity = np.asarray(row_identity, dtype=np.int64)
+        self._identity_order = np.argsort(self.row_identity, kind='stable')
+        self._identity_offsets = np.concatenate([[0], np.cumsum(np.bincount(self.row_identity, minlength=len(self.identity_names)))]).astype(np.int64)
+
+        # Filled in by FaceGallery before the snapshot is published
+        self.prototypes = self.embeddings
+        self.prototype_scales = self.scales
+        self.prototype_identity = self.row_identity
+        self.index = BruteForceIndex(self.prototypes, self.prototype_scales)
+        self._hash_rows = None
+        self._identity_ids = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def rows_float32(self, rows=None):
+        """Dequantized float32 copy of the given rows (all rows by default)."""
+        if rows is None:
+            return dequantize(self.embeddings, self.scales)
+        return dequantize(self.embeddings[rows], self.scales[rows] if self.scales is not None else None)
+
+    def row_for_hash(self, content_hash):
+        """Index of a row with this content hash, or None."""
+        if self._hash_rows is None:
+            self._hash_rows = {h: i for i, h in enumerate(self.hashes)}
+        return self._hash_rows.get(content_hash)
+
+    def identity_of(self, name):
+        """Identity index of a person name, or None if nobody by that name is enrolled."""
+        if self._identity_ids is None:
+            self._identity_ids = {n: i for i, n in enumerate(self.identity_names)}
+        return self._identity_ids.get(name)
+
+    def identity_rows(self, identity):
+        """Row indices of every enrolled image of one identity."""
+        return self._identity_order[self._identity_offsets[identity]:self._identity_offsets[identity + 1]]
+
+
+EMPTY_EMBEDDINGS = np.zeros((0, 0), dtype=np.float32)
+
+
+class FaceGallery:
+    """
+    Resident in-memory gallery of enrolled face embeddings.
+
+    The embeddings are one row-major matrix of L2-normalized rows with a
+    parallel array of labels (the enrolled filenames): float32 while being
+    updated, then usually a read-only memory map of the gallery file in
+    float16, or int8 with one scale per row (see gallery_shard.py). A match
+    is a single vectorized cosine pass, upcasting quantized rows in chunks.
+
+    Names are resolved once per row with name_fn. With prototype_mode
+    'mean' or 'kmedoids' the search runs over per-identity prototypes
+    instead of every image, and only the images of the `rerank` best
+    identities are compared exactly; 'image' searches every row.
+
+    Readers grab `snapshot` (a plain attribute read, never blocks); writers
+    are serialized and publish a complete new GallerySnapshot atomically.
+    The search backend comes from index_factory(embeddings) (exact brute
+    force by default, see search_index.py) and is updated incrementally.
+    """
+
+    def __init__(self, threshold=0.68, index_factory=None, name_fn=parse_identity_name,
+                 prototype_mode='mean', medoids_per_identity=3, rerank=3):
+        if prototype_mode not in PROTOTYPE_MODES:
+            raise ValueError(f"Unknown prototype mode: {prototype_mode}")
+        self.threshold = threshold
+        self.index_factory = index_factory or BruteForceIndex
+        self.name_fn = name_fn
+        self.prototype_mode = prototype_mode
+        self.medoids_per_identity = medoids_per_identity
+        self.rerank = rerank
+        self.snapshot = GallerySnapshot(EMPTY_EMBEDDINGS, [], [], [], 0)
+        self._medoid_cache = {}
+        self._write_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    @property
+    def labels(self):
+        return self.snapshot.labels
+
+    @property
+    def identity_count(self):
+        return len(self.snapshot.identity_names)
+
+    def _prototypes(self, snapshot):
+        """(prototypes, prototype_identity) for a snapshot according to prototype_mode."""
+        if self.prototype_mode == 'image' or len(snapshot) == 0:
+            return snapshot.embeddings, snapshot.scales, snapshot.row_identity
+
+        order, offsets = snapshot._identity_order, snapshot._identity_offsets
+        if self.prototype_mode == 'mean':
+            sums = np.add.reduceat(snapshot.rows_float32(order), offsets[:-1], axis=0)
+            return l2_normalize(sums), None, np.arange(len(snapshot.identity_names))
+
+        blocks, owners, cache = [], [], {}
+        for identity, name in enumerate(snapshot.identity_names):
+            rows = snapshot.identity_rows(identity)
+            key = tuple(sorted(snapshot.hashes[rows]))
+            cached = self._medoid_cache.get(name)
+            medoids = cached[1] if cached and cached[0] == key else _kmedoids(snapshot.rows_float32(rows), self.medoids_per_identity)
+            cache[name] = (key, medoids)
+            blocks.append(medoids)
+            owners.append(np.full(len(medoids), identity, dtype=np.int64))
+        self._medoid_cache = cache
+        return np.ascontiguousarray(np.vstack(blocks), dtype=np.float32), None, np.concatenate(owners)
+
+    def _publish(self, embeddings, labels, hashes, keep=None, n_new=0, scales=None, version=None):
+        current = self.snapshot
+        snapshot = GallerySnapshot(embeddings, labels, hashes, [self.name_fn(l) for l in labels],
+                                   version if version is not None else current.version + 1, scales=scales)
+        snapshot.prototypes, snapshot.prototype_scales, snapshot.prototype_identity = self._prototypes(snapshot)
+
+        if len(current) == 0 or current.index.kind == 'exact':
+            snapshot.index = self.index_factory(snapshot.prototypes, snapshot.prototype_scales)
+        elif self.prototype_mode == 'image' and keep is not None:
+            snapshot.index = current.index.updated(snapshot.prototypes, keep, n_new)
+        else:
+            snapshot.index = current.index.rebuilt(snapshot.prototypes, snapshot.prototype_scales)
+        self.snapshot = snapshot
+
+    def load_snapshot(self, embeddings, labels, hashes, scales=None, version=None):
+        """
+        Publish precomputed (already normalized) rows as-is, e.g. memory-mapped
+        from a shard. Passing the current version swaps storage without
+        counting as a gallery change.
+        """
+        with self._write_lock:
+            self._publish(embeddings, labels, hashes, scales=scales, version=version)
+        logger.info(f">>> Gallery loaded: {len(self)} faces (v{self.version}, {self.snapshot.embeddings.dtype})")
+
+    def swap_storage(self, version, embeddings, scales=None, new_version=None):
+        """
+        Replace the rows of snapshot `version` with an equivalent (e.g.
+        quantized, memory-mapped) copy, optionally renumbering it (e.g. to
+        the version it was published under). No-op if the gallery moved on since.
+        """
+        with self._write_lock:
+            current = self.snapshot
+            if current.version != version or len(embeddings) != len(current):
+                return False
+            self._publish(embeddings, current.labels, current.hashes, scales=scales,
+                          version=new_version if new_version is not None else version)
+            return True
+
+    def has_hash(self, content_hash):
+        return self.snapshot.row_for_hash(content_hash) is not None
+
+    def sync_entries(self, entries, image_dir, embed_fn, cache=None, path_fn=None):
+        """
+        Bring the gallery in line with entries ({label: content_hash}). Rows
+        whose hash is unchanged are kept, cached hashes are reused, and only
+        the rest are embedded from image_dir (or from path_fn(label), e.g.
+        for content-addressed files). A None hash means "hash the local
+        file". Returns True if the gallery changed; the cache is then pruned
+        to the enrolled hashes.
+        """
+        with self._write_lock:
+            changed = self._apply(dict(entries), image_dir, embed_fn, cache, path_fn)
+            if changed and cache is not None:
+                cache.retain(self.snapshot.hashes)
+            return changed
+
+    def update_entries(self, entries, image_dir, embed_fn, cache=None, removed=(), path_fn=None):
+        """
+        Like sync_entries, but only adds/replaces the given labels and drops
+        `removed`; the cache keeps embeddings computed for other pending
+        changes.
+        """
+        with self._write_lock:
+            merged = dict(zip(self.snapshot.labels, self.snapshot.hashes))
+            for label in removed:
+                merged.pop(label, None)
+            merged.update(entries)
+            return self._apply(merged, image_dir, embed_fn, cache, path_fn)
+
+    def _apply(self, entries, image_dir, embed_fn, cache, path_fn=None):
+        current = self.snapshot
+        known = dict(zip(current.labels, current.hashes))
+        path_fn = path_fn or (lambda label: os.path.join(image_dir, label))
+
+        wanted = {}
+        for label, content_hash in entries.items():
+            if content_hash is None:
+                try:
+                    content_hash = file_md5(path_fn(label))
+                except OSError as e:
+                    logger.warning(f"⚠️ Could not read {label}: {e}")
+                    continue
+            wanted[label] = content_hash
+
+        keep = np.array([known[l] == wanted.get(l) for l in current.labels], dtype=bool)
+        new_labels, new_hashes, new_vectors = [], [], []
+        for label in sorted(wanted):
+            content_hash = wanted[label]
+            if known.get(label) == content_hash:
+                continue
+            # Same content already in the gallery (e.g. renamed file)? Reuse its row
+            row = current.row_for_hash(content_hash)
+            vector = current.rows_float32([row])[0] if row is not None else None
+            if vector is None and cache is not None:
+                vector = cache.get(content_hash)
+            if vector is None:
+                try:
+                    vector = embed_fn(path_fn(label))
+                except Exception as e:
+                    logger.warning(f"⚠️ Could not embed {label}: {e}")
+                    continue
+                if cache is not None:
+                    cache.put(content_hash, vector)
+            new_labels.append(label)
+            new_hashes.append(content_hash)
+            new_vectors.append(vector)
+
+        if keep.all() and not new_labels:
+            return False
+
+        blocks = [current.rows_float32(np.flatnonzero(keep))] if keep.any() else []
+        if new_vectors:
+            blocks.append(l2_normalize(np.vstack(new_vectors)))
+        merged = np.vstack(blocks) if blocks else EMPTY_EMBEDDINGS
+
+        self._publish(merged, list(current.labels[keep]) + new_labels, list(current.hashes[keep]) + new_hashes,
+                      keep=keep, n_new=len(new_vectors))
+        logger.info(f">>> Gallery updated: +{len(new_labels)} / -{int((~keep).sum())} faces (v{self.version})")
+        return True
+
+    def match_many(self, embeddings, snapshot=None):
+        """
+        For every row of embeddings (e.g. all faces of one probe), against
+        one snapshot (the current one by default): (name, label,
+        cosine_distance) of the closest enrolled image, or None if the
+        gallery is empty or the best distance is above the threshold. The
+        index picks candidate identities from their prototypes; their images
+        are then compared exactly.
+        """
+        snapshot = snapshot if snapshot is not None else self.snapshot
+        return [self._match(snapshot, embedding) for embedding in embeddings]
+
+    def _match(self, snapshot, embedding):
+        if len(snapshot) == 0:
+            return None
+
+        query = l2_normalize(embedding)
+        k = 1 if self.prototype_mode == 'image' else self.rerank
+        prototype_rows, _ = snapshot.index.search(query, k)
+        if len(prototype_rows) == 0:
+            return None
+        return self._closest(snapshot, query, np.unique(snapshot.prototype_identity[prototype_rows]))
+
+    def _closest(self, snapshot, query, identities):
+        """(name, label, distance) of the nearest image among these identities, None above the threshold."""
+        rows = np.concatenate([snapshot.identity_rows(i) for i in identities])
+        scales = snapshot.scales[rows] if snapshot.scales is not None else None
+        distances = 1.0 - cosine_scores(snapshot.embeddings[rows], query, scales)
+        best = int(np.argmin(distances))
+        if distances[best] > self.threshold:
+            return None
+        row = rows[best]
+        return snapshot.names[row], snapshot.labels[row], float(distances[best])
+
+    def verify_many(self, embeddings, names, snapshot=None):
+        """
+        For each (embedding, claimed name), e.g. a classifier's answer: the
+        match against that person's own images, or None if none is within
+        the threshold or nobody by that name is enrolled.
+        """
+        snapshot = snapshot if snapshot is not None else self.snapshot
+        results = []
+        for embedding, name in zip(embeddings, names):
+            identity = snapshot.identity_of(name) if len(snapshot) else None
+            results.append(None if identity is None else self._closest(snapshot, l2_normalize(embedding), [identity]))
+        return results
+
+    def index_recall(self, n_queries=200):
+        """Recall@1 of the current search backend against exact search."""
+        snapshot = self.snapshot
+        if len(snapshot) == 0 or snapshot.index.kind == 'exact':
+            return 1.0
+        return recall_at_1(snapshot.index, sample_queries(snapshot.prototypes, n=n_queries))
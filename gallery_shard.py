@@ -0,0 +1,109 @@
+import os
+import json
+import struct
+import numpy as np
+from quantization import STORAGE_DTYPES, quantize, dequantize
+
+SHARD_MAGIC = b'BSGALLERY1'
+SHARD_FORMAT_VERSION = 2
+SHARD_ALIGN = 64
+
+
+def _aligned(offset):
+    return offset + (-offset) % SHARD_ALIGN
+
+
+def write_shard(path, embeddings, labels, hashes, fingerprint, version, dtype='float32',
+                model_name=None, scales=None, extra=None):
+    """
+    Write a gallery shard: magic, header length, JSON header, then the raw
+    row-major embedding matrix (float32, float16 or int8) aligned to 64
+    bytes so it can be memory-mapped; int8 shards append one float32 scale
+    per row. The header carries model name, dimension, version, labels,
+    content hashes and the model/detector fingerprint.
+    """
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"Unsupported shard dtype: {dtype}")
+    embeddings = np.asarray(embeddings)
+    if embeddings.dtype != np.float32:
+        embeddings = dequantize(embeddings, scales)
+    matrix, row_scales = quantize(embeddings, dtype)
+    header = {
+        "format_version": SHARD_FORMAT_VERSION,
+        "model_name": model_name,
+        "fingerprint": fingerprint,
+        "version": version,
+        "dtype": dtype,
+        "count": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "labels": [str(l) for l in labels],
+        "hashes": [str(h) for h in hashes],
+        **(extra or {}),
+    }
+    header_bytes = json.dumps(header).encode()
+    data_offset = _aligned(len(SHARD_MAGIC) + 4 + len(header_bytes))
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SHARD_MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b'\0' * (data_offset - f.tell()))
+        f.write(matrix.tobytes())
+        if row_scales is not None:
+            f.write(b'\0' * (_aligned(f.tell()) - f.tell()))
+            f.write(row_scales.astype(np.float32).tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+def _read_header(f, path):
+    if f.read(len(SHARD_MAGIC)) != SHARD_MAGIC:
+        raise ValueError(f"{path} is not a gallery shard")
+    (header_len,) = struct.unpack('<I', f.read(4))
+    header = json.loads(f.read(header_len))
+    return header, _aligned(len(SHARD_MAGIC) + 4 + header_len)
+
+
+def read_shard_header(path):
+    """Returns (header, data_offset) without touching the embedding matrix."""
+    with open(path, 'rb') as f:
+        return _read_header(f, path)
+
+
+def read_shard(path, mmap=True):
+    """
+    Returns (header, embeddings, scales). By default embeddings (and int8
+    scales) are read-only memmaps, so every process mapping the same file
+    shares one copy in the page cache.
+
+    Header and rows come from one open file, so a concurrent os.replace of
+    path (another worker committing) can never pair this header with the
+    next file's bytes; the header must also agree with the file size.
+    """
+    with open(path, 'rb') as f:
+        header, offset = _read_header(f, path)
+        count, dim, dtype = header["count"], header["dim"], np.dtype(header["dtype"])
+        if len(header["labels"]) != count or len(header["hashes"]) != count:
+            raise ValueError(f"{path}: header lists {len(header['labels'])} labels for {count} rows")
+        if count == 0:
+            return header, np.zeros((0, 0), dtype=np.float32), None
+        has_scales = header["dtype"] == 'int8'
+        scales_offset = _aligned(offset + count * dim * dtype.itemsize)
+        expected_size = scales_offset + count * 4 if has_scales else offset + count * dim * dtype.itemsize
+        size = os.fstat(f.fileno()).st_size
+        if size != expected_size:
+            raise ValueError(f"{path}: {size} bytes, header ({count}x{dim} {dtype}) needs {expected_size}")
+
+        if mmap:
+            embeddings = np.memmap(f, dtype=dtype, mode='r', offset=offset, shape=(count, dim))
+            scales = np.memmap(f, dtype=np.float32, mode='r', offset=scales_offset, shape=(count,)) if has_scales else None
+        else:
+            f.seek(offset)
+            embeddings = np.frombuffer(f.read(count * dim * dtype.itemsize), dtype=dtype).reshape(count, dim)
+            scales = None
+            if has_scales:
+                f.seek(scales_offset)
+                scales = np.frombuffer(f.read(count * 4), dtype=np.float32)
+    return header, embeddings, scales
@@ -0,0 +1,342 @@
+import os
+import logging
+import time
+import base64
+import hashlib
+import shutil
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from gallery import IMAGE_EXTENSIONS
+from content_store import MANIFEST_FILENAME, OBJECTS_DIR, Manifest, object_hash, object_name, safe_identity_name
+
+logger = logging.getLogger("GcsSync")
+
+
+class PreconditionFailed(Exception):
+    """Raised by LocalBlob like GCS's 412 when if_generation_match does not hold."""
+    code = 412
+
+
+class LocalBlob:
+    """Minimal stand-in for google.cloud.storage.Blob backed by a local file."""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self._path = os.path.join(bucket.root, name)
+
+    @property
+    def generation(self):
+        return os.stat(self._path).st_mtime_ns if os.path.exists(self._path) else None
+
+    @property
+    def md5_hash(self):
+        if not os.path.exists(self._path):
+            return None
+        with open(self._path, 'rb') as f:
+            return base64.b64encode(hashlib.md5(f.read()).digest()).decode()
+
+    @property
+    def size(self):
+        return os.path.getsize(self._path) if os.path.exists(self._path) else None
+
+    def exists(self):
+        return os.path.exists(self._path)
+
+    def download_to_filename(self, filename):
+        shutil.copyfile(self._path, filename)
+
+    def download_as_bytes(self):
+        with open(self._path, 'rb') as f:
+            return f.read()
+
+    def upload_from_filename(self, filename, if_generation_match=None):
+        if if_generation_match is not None and (self.generation or 0) != if_generation_match:
+            raise PreconditionFailed(f"{self.name} changed since generation {if_generation_match}")
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        tmp_path = f"{self._path}.{threading.get_ident()}.part"
+        shutil.copyfile(filename, tmp_path)
+        os.replace(tmp_path, self._path)
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):
+        if if_generation_match is not None and (self.generation or 0) != if_generation_match:
+            raise PreconditionFailed(f"{self.name} changed since generation {if_generation_match}")
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        tmp_path = f"{self._path}.{threading.get_ident()}.part"
+        with open(tmp_path, 'wb') as f:
+            f.write(data.encode() if isinstance(data, str) else data)
+        os.replace(tmp_path, self._path)
+
+    def delete(self):
+        os.remove(self._path)
+
+
+class LocalBucket:
+    """
+    Filesystem stand-in for a GCS bucket (list_blobs/blob), used for local
+    runs, benchmarks and tests. Object names map to paths under root.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.name = f"local:{root}"
+        os.makedirs(root, exist_ok=True)
+
+    def blob(self, name):
+        return LocalBlob(self, name)
+
+    def get_blob(self, name):
+        blob = LocalBlob(self, name)
+        return blob if blob.exists() else None
+
+    def copy_blob(self, blob, destination_bucket, new_name):
+        target = destination_bucket.blob(new_name)
+        target.upload_from_filename(blob._path)
+        return target
+
+    def list_blobs(self, prefix=''):
+        names = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                name = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, '/')
+                if name.startswith(prefix):
+                    names.append(name)
+        return [LocalBlob(self, name) for name in sorted(names)]
+
+
+def blob_md5_hex(blob):
+    """Hex md5 of a blob from its metadata (None for composite objects)."""
+    return base64.b64decode(blob.md5_hash).hex() if blob.md5_hash else None
+
+
+def download_atomic(blob, local_path):
+    """Download to a temp file in the same folder, then rename over local_path."""
+    tmp_path = f"{local_path}.{threading.get_ident()}.part"
+    try:
+        blob.download_to_filename(tmp_path)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, local_path)
+        return size
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class SyncResult:
+    """Outcome of one bucket -> folder sync."""
+
+    def __init__(self):
+        self.downloaded = []
+        self.removed = []
+        self.failed = []
+        self.skipped = []
+        self.remote = {}
+        self.bytes = 0
+        self.seconds = 0.0
+
+    @property
+    def changed(self):
+        return self.downloaded + self.removed
+
+    def throughput(self):
+        """(files/s, MB/s) for the downloads in this sync."""
+        if self.seconds <= 0:
+            return 0.0, 0.0
+        return len(self.downloaded) / self.seconds, self.bytes / self.seconds / 1e6
+
+
+def read_manifest(bucket, blob_name):
+    """(Manifest, generation) of the content-store manifest; (empty, 0) if there is none yet."""
+    blob = bucket.get_blob(blob_name)
+    if blob is None:
+        return Manifest(), 0
+    return Manifest.from_bytes(blob.download_as_bytes()), blob.generation
+
+
+def update_manifest(bucket, blob_name, change_fn, retries=5):
+    """
+    Read-modify-write of the bucket manifest. change_fn(manifest) edits it in
+    place and returns True if it changed; the write only succeeds if nobody
+    else wrote the manifest in between (generation precondition), otherwise
+    it is re-read and change_fn runs again. Returns (manifest, changed).
+    """
+    for attempt in range(retries):
+        manifest, generation = read_manifest(bucket, blob_name)
+        if not change_fn(manifest):
+            return manifest, False
+        try:
+            bucket.blob(blob_name).upload_from_string(
+                manifest.to_bytes(), content_type='application/json', if_generation_match=generation
+            )
+            return manifest, True
+        except Exception as e:
+            if getattr(e, 'code', None) != 412 or attempt == retries - 1:
+                raise
+            logger.debug(f">>> Manifest changed concurrently, retrying ({attempt + 1}/{retries})")
+
+
+def manifest_fingerprint(bucket, blob_name):
+    """Change-detection key for the content store: one metadata read of the manifest, no listing."""
+    blob = bucket.get_blob(blob_name)
+    return str(blob.generation) if blob is not None else "missing"
+
+
+def sync_manifest(bucket, prefix, dest_dir, need_fn=None, max_workers=8):
+    """
+    Mirror the content store under prefix (manifest.json + objects/) into
+    dest_dir by comparing the bucket manifest with the local copy.
+
+    Objects are immutable and named by their md5, so one is downloaded only
+    if it is missing locally and need_fn(object_name, md5_hex) does not
+    return False (e.g. its embedding is cached). Objects dropped from the
+    manifest are deleted locally. result.remote is the {label: md5_hex} map
+    of every enrolled image; objects that could not be downloaded are in
+    result.failed and the caller must treat the sync as incomplete.
+    """
+    result = SyncResult()
+    started = time.perf_counter()
+    objects_dir = os.path.join(dest_dir, OBJECTS_DIR)
+    os.makedirs(objects_dir, exist_ok=True)
+    local_path = os.path.join(dest_dir, MANIFEST_FILENAME)
+    previous = Manifest.load(local_path)
+    manifest, _ = read_manifest(bucket, f"{prefix}{MANIFEST_FILENAME}")
+    result.remote = manifest.entries()
+
+    wanted = manifest.objects()
+    pending = []
+    for obj in sorted(wanted):
+        if os.path.exists(os.path.join(objects_dir, obj)):
+            continue
+        if need_fn is not None and not need_fn(obj, object_hash(obj)):
+            result.skipped.append(obj)
+            continue
+        pending.append(obj)
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as pool:
+            futures = {pool.submit(download_atomic, bucket.blob(f"{prefix}{OBJECTS_DIR}/{obj}"),
+                                   os.path.join(objects_dir, obj)): obj for obj in pending}
+            for future in as_completed(futures):
+                obj = futures[future]
+                try:
+                    result.bytes += future.result()
+                    result.downloaded.append(obj)
+                except Exception as e:
+                    result.failed.append(obj)
+                    logger.error(f"❌ Download failed for {obj}: {e}")
+
+    # Only what the previous manifest listed: objects written by an enrollment still in flight stay
+    for obj in previous.objects() - wanted:
+        path = os.path.join(objects_dir, obj)
+        if os.path.exists(path):
+            os.remove(path)
+        result.removed.append(obj)
+    manifest.save(local_path)
+
+    result.seconds = time.perf_counter() - started
+    if result.downloaded:
+        files_per_s, mb_per_s = result.throughput()
+        logger.info(f">>> Downloaded {len(result.downloaded)} faces ({result.bytes / 1e6:.2f} MB) "
+              f"in {result.seconds:.2f}s [{files_per_s:.1f} files/s, {mb_per_s:.2f} MB/s]")
+    return result
+
+
+def import_legacy_blobs(bucket, prefix, manifest, name_fn):
+    """
+    Move the flat layout ('<prefix>Jane_Doe_photo.jpg') into the content
+    store: every image blob is copied server-side to objects/<md5><ext> and
+    named in manifest with name_fn(filename). The old blobs are left in
+    place. Returns how many entries were added.
+    """
+    added = 0
+    for blob in bucket.list_blobs(prefix=prefix):
+        filename = blob.name[len(prefix):]
+        if '/' in filename or not filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        md5 = blob_md5_hex(blob)
+        if md5 is None:
+            logger.warning(f"⚠️ {blob.name} has no md5 (composite object), not imported.")
+            continue
+        obj = object_name(md5, filename)
+        target = f"{prefix}{OBJECTS_DIR}/{obj}"
+        if not bucket.blob(target).exists():
+            bucket.copy_blob(blob, bucket, target)
+        added += manifest.add(safe_identity_name(name_fn(filename)), obj)
+    if added:
+        logger.info(f">>> Imported {added} images from the flat layout into the content store.")
+    return added
+
+
+class GallerySyncer:
+    """
+    Background syncer that keeps the local gallery in line with the bucket.
+
+    Every `interval` seconds it reads a cheap fingerprint (the manifest's
+    generation); only when that changes does it run `sync_fn` (download +
+    gallery refresh).
+    Request handlers never wait on it, they just read the latest published
+    gallery snapshot and can report `staleness()`. `on_synced(timestamp)`
+    is told about every confirmed sync (e.g. to share it with other workers).
+    """
+
+    def __init__(self, sync_fn, fingerprint_fn=None, interval=30, on_synced=None):
+        self.sync_fn = sync_fn
+        self.fingerprint_fn = fingerprint_fn
+        self.interval = interval
+        self.on_synced = on_synced
+        self.last_synced_at = None
+        self.last_error = None
+        self.sync_count = 0
+        self._fingerprint = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def run_once(self, force=False):
+        """Sync if the bucket changed (or force). Returns True if sync_fn ran."""
+        with self._lock:
+            try:
+                fingerprint = self.fingerprint_fn() if self.fingerprint_fn else None
+                if not force and fingerprint is not None and fingerprint == self._fingerprint:
+                    self._mark_synced()
+                    return False
+                self.sync_fn()
+                self._fingerprint = fingerprint
+                self._mark_synced()
+                self.last_error = None
+                self.sync_count += 1
+                return True
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"❌ Background sync failed: {e}")
+                traceback.print_exc()
+                return False
+
+    def _mark_synced(self):
+        self.last_synced_at = time.time()
+        if self.on_synced:
+            self.on_synced(self.last_synced_at)
+
+    def staleness(self):
+        """Seconds since the gallery was last confirmed in sync with the bucket."""
+        if self.last_synced_at is None:
+            return None
+        return time.time() - self.last_synced_at
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="gallery-syncer", daemon=True)
+        self._thread.start()
+        logger.info(f">>> Background gallery sync every {self.interval}s")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
@@ -0,0 +1,44 @@
+"""
+gunicorn settings for the multi-worker deployment (see Dockerfile).
+
+The app is preloaded: gunicorn's master imports main.py (TensorFlow,
+DeepFace, OpenCV and the rest of the Python code) once and forks the
+workers from it, so that memory is shared copy-on-write and workers start
+fast. The models themselves are built in each worker after the fork
+(TensorFlow and TFLite thread pools do not survive a fork); on a fresh
+container their weight files are downloaded once, before forking, so the
+workers do not race to download them.
+
+Workers share the gallery through EMBEDDINGS_DIR: one leader worker syncs
+with GCS and writes the gallery file, every worker memory-maps it
+read-only and reloads it when the version counter moves (shared_gallery.py).
+"""
+import os
+import sys
+import subprocess
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+accesslog = '-'
+
+# Split the CPUs between workers instead of giving each one all of them
+_cpus_per_worker = str(max(1, (os.cpu_count() or 1) // workers))
+os.environ.setdefault('INFERENCE_WORKERS', _cpus_per_worker)
+os.environ.setdefault('TFLITE_THREADS', _cpus_per_worker)
+
+
+def _weights_dir():
+    return os.path.join(os.environ.get('DEEPFACE_HOME', os.path.expanduser('~')), '.deepface', 'weights')
+
+
+def on_starting(server):
+    """Fetch the model weights in a throwaway process if this container has none yet."""
+    weights_dir = _weights_dir()
+    if os.path.isdir(weights_dir) and os.listdir(weights_dir):
+        return
+    server.log.info(f">>> No model weights in {weights_dir}, downloading them before forking workers...")
+    subprocess.run([sys.executable, '-c', 'import main; main.warm_models()'], check=False)
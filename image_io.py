@@ -0,0 +1,33 @@
+import io
+import numpy as np
+import cv2
+from PIL import Image
+
+
+def decode_image(contents, max_side=None, return_scale=False):
+    """
+    Decode raw upload bytes straight into a BGR uint8 array (no temp file).
+
+    OpenCV handles the common formats; PIL is the fallback for anything it
+    cannot read. If max_side is set, images whose longest side exceeds it
+    are downscaled (INTER_AREA) before detection, which keeps the detector
+    cost of full-resolution phone photos bounded. With return_scale the
+    result is (img, scale), where original coordinates = img coordinates / scale.
+    """
+    buffer = np.frombuffer(contents, dtype=np.uint8)
+    img = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+    if img is None:
+        try:
+            with Image.open(io.BytesIO(contents)) as pil_img:
+                img = cv2.cvtColor(np.asarray(pil_img.convert('RGB')), cv2.COLOR_RGB2BGR)
+        except Exception as e:
+            raise ValueError(f"Could not decode image: {e}")
+
+    scale = 1.0
+    if max_side:
+        height, width = img.shape[:2]
+        longest = max(height, width)
+        if longest > max_side:
+            scale = max_side / longest
+            img = cv2.resize(img, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    return (img, scale) if return_scale else img
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolSaturated(Exception):
+    """Raised when the inference queue is full (surface as HTTP 429)."""
+
+
+class InferencePool:
+    """
+    Bounded executor for blocking inference work called from async endpoints.
+
+    At most `max_workers` jobs run at once and at most `max_queue` more may
+    wait; anything beyond that is rejected immediately with PoolSaturated
+    instead of piling up. Threads (not processes) are used because
+    TensorFlow releases the GIL inside its kernels and all workers share one
+    copy of the loaded models.
+    """
+
+    def __init__(self, max_workers=2, max_queue=8, timeout=30.0):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.rejected = 0
+        self.timed_out = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Jobs currently running or queued."""
+        return self._pending
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    async def run(self, fn, *args, timeout=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) on the pool and await the result. Raises
+        PoolSaturated when full and asyncio.TimeoutError after `timeout`
+        seconds. A running job keeps its slot until it really finishes; a
+        job still queued at the timeout is cancelled and frees it at once.
+        """
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PoolSaturated(f"{self._pending} inference jobs pending")
+        with self._lock:
+            self._pending += 1
+
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        # Fires when the job finishes and also when it is cancelled before starting
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -1,31 +1,140 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import os
 import shutil
+import tempfile
+import threading
+import asyncio
+import hashlib
 import json
+import itertools
+import logging
+from typing import List
 import numpy as np
 import cv2
 import uvicorn
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from deepface import DeepFace
+from deepface.commons import functions as deepface_functions
+from face_detection import make_detector
 from google_cse_api import GoogleCSEAPI
+from gallery import FaceGallery, l2_normalize, parse_identity_name
+from face_head import EmbeddingHead
+from tflite_model import TFLiteModel
+from search_index import make_index
+from embedding_cache import EmbeddingCache
+from gcs_sync import (GallerySyncer, LocalBucket, download_atomic, import_legacy_blobs, manifest_fingerprint,
+                      sync_manifest, update_manifest)
+from content_store import (MANIFEST_FILENAME, OBJECTS_DIR, Manifest, enrollment_entry, import_legacy_files,
+                           label_object, object_hash, object_label, write_object)
+from gallery_shard import write_shard, read_shard, read_shard_header
+from shared_gallery import SharedGallery
+from quantization import quantization_report
+from inference_pool import InferencePool, PoolSaturated
+from embedding_batcher import EmbeddingBatcher
+from image_io import decode_image
+from result_cache import ResultCache, perceptual_hash
+from bulk_enroll import BulkEnrollment, iter_archive, iter_uploads
+from metrics import Metrics
+from profiler import SamplingProfiler
 from google.cloud import storage
 from PIL import Image
 import traceback
+import importlib.metadata
+
+# DEBUG adds per-request detail (stage timings, local DB listing, cloud paths)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(level=LOG_LEVEL, format="%(message)s", force=True)
+logger = logging.getLogger("BionicScan")
 
-print(">>> Loading main.py...")
+logger.info(">>> Loading main.py...")
 
 # --- CONFIGURACIoN ---
-UPLOAD_DIR = '/tmp/uploads'
-DB_PATH = '/tmp/db'  # Local Database for DeepFace
+DB_PATH = os.environ.get('DB_PATH', '/tmp/db')  # Local Database for DeepFace
+OBJECTS_PATH = os.path.join(DB_PATH, OBJECTS_DIR)  # enrolled images, one file per content ('<md5>.jpg')
+LOCAL_MANIFEST = os.path.join(DB_PATH, MANIFEST_FILENAME)  # name -> objects (mirror of the bucket's, if any)
+EMBEDDINGS_DIR = os.environ.get('EMBEDDINGS_DIR', '/tmp/embeddings')
+EMBEDDINGS_CACHE = os.path.join(EMBEDDINGS_DIR, 'embeddings_arcface.npz')  # content-hash -> embedding
 GCS_BUCKET_NAME = 'bionic-scan-v2.appspot.com' # Default App Engine bucket
 GCS_DB_PREFIX = 'database/'
+GCS_MANIFEST_BLOB = f"{GCS_DB_PREFIX}{MANIFEST_FILENAME}"  # source of truth: who is enrolled with which images
+GCS_OBJECTS_PREFIX = f"{GCS_DB_PREFIX}{OBJECTS_DIR}/"  # content-addressed image bytes
+GCS_SYNC_INTERVAL = float(os.environ.get('GCS_SYNC_INTERVAL', '30'))  # seconds between change checks
+GCS_LOCAL_BUCKET_DIR = os.environ.get('GCS_LOCAL_BUCKET_DIR')  # use a local folder instead of GCS
+GCS_DOWNLOAD_WORKERS = int(os.environ.get('GCS_DOWNLOAD_WORKERS', '16'))
+GCS_SHARD_BLOB = 'shards/gallery_arcface.bsg'  # precomputed embeddings shared by all instances
+GALLERY_FILE = os.path.join(EMBEDDINGS_DIR, 'gallery_arcface.bsg')  # local gallery, memory-mapped read-only by every worker
+GALLERY_DTYPE = os.environ.get('GALLERY_DTYPE', 'float16')  # on-disk/in-memory rows: float32, float16 or int8
+GALLERY_POLL_INTERVAL = float(os.environ.get('GALLERY_POLL_INTERVAL', '1'))  # seconds between checks for another worker's changes
+GALLERY_WAIT_TIMEOUT = float(os.environ.get('GALLERY_WAIT_TIMEOUT', '600'))  # follower start-up: report an error after this long without a gallery
 
 # Ensure directories exist
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(DB_PATH, exist_ok=True)
 
+# Face matching config
+MODEL_NAME = 'ArcFace'
+DETECTOR_BACKEND = os.environ.get('DETECTOR_BACKEND', 'ssd')  # accurate detector
+DETECTOR_FAST_BACKEND = os.environ.get('DETECTOR_FAST_BACKEND', '')  # e.g. 'opencv' (Haar) or 'mediapipe'; '' = no cascade
+# Below this fast-detector score, escalate; '' = per-backend default (Haar scores are not capped at 1,
+# see face_detection.FAST_MIN_CONFIDENCE)
+DETECTOR_FAST_MIN_CONFIDENCE = float(os.environ['DETECTOR_FAST_MIN_CONFIDENCE']) if os.environ.get('DETECTOR_FAST_MIN_CONFIDENCE') else None
+DETECTOR_ESCALATE_EMPTY = os.environ.get('DETECTOR_ESCALATE_EMPTY', '1') == '1'  # retry faceless images on the accurate detector
+DETECTOR_NAME = f"{DETECTOR_FAST_BACKEND}>{DETECTOR_BACKEND}" if DETECTOR_FAST_BACKEND else DETECTOR_BACKEND
+MATCH_THRESHOLD = 0.68  # DeepFace cosine threshold for ArcFace
+GALLERY_PROTOTYPES = os.environ.get('GALLERY_PROTOTYPES', 'mean')  # 'mean', 'kmedoids' or 'image' (search every image)
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'exact')  # 'exact' or 'ivf' (approximate, for large galleries)
+IVF_MIN_SIZE = int(os.environ.get('IVF_MIN_SIZE', '2000'))  # below this many faces exact search is used anyway
+IVF_NPROBE = int(os.environ.get('IVF_NPROBE', '8'))  # clusters scanned per query (recall vs speed)
+PROBE_MAX_SIDE = int(os.environ.get('PROBE_MAX_SIDE', '1280'))  # downscale larger probes before detection (0 = off)
+PROBE_MAX_FACES = int(os.environ.get('PROBE_MAX_FACES', '20'))  # faces identified per probe (most confident first)
+
+# Optional classifier head trained with `python entrenar.py --modo cabeza` on ArcFace embeddings
+HEAD_PATH = os.environ.get('HEAD_PATH', '')  # e.g. cabeza_arcface.npz; '' = gallery search only
+HEAD_MIN_PROBABILITY = float(os.environ.get('HEAD_MIN_PROBABILITY', '0.9'))  # below this, fall back to the gallery
+# The head is closed-set (every face gets some enrolled name), so its answer also has to pass
+# MATCH_THRESHOLD against that person's gallery images; otherwise the face goes through normal search.
+
+# Cache of /predict/ results for resubmitted images (dropped on every gallery change)
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '1024'))  # 0 disables it
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', '300'))  # seconds
+RESULT_CACHE_PERCEPTUAL = os.environ.get('RESULT_CACHE_PERCEPTUAL', '0') == '1'  # also match re-encoded copies
+
+# Sampling profiler: PROFILER_HZ > 0 samples continuously from startup; /api/profile samples on demand
+PROFILER_HZ = int(os.environ.get('PROFILER_HZ', '0'))
+
+# Inference executor (keeps DeepFace/TensorFlow off the asyncio event loop)
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', str(os.cpu_count() or 1)))
+INFERENCE_QUEUE = int(os.environ.get('INFERENCE_QUEUE', str(4 * INFERENCE_WORKERS)))  # waiting jobs before 429
+INFERENCE_TIMEOUT = float(os.environ.get('INFERENCE_TIMEOUT', '30'))  # seconds per request
+
+# Micro-batching of ArcFace forward passes across concurrent requests
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', '8'))  # 1 disables batching
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', '5'))
+
+# ArcFace exported by `python exportar.py arcface [--int8]`; '' = Keras model via DeepFace
+ARCFACE_TFLITE = os.environ.get('ARCFACE_TFLITE', '')
+TFLITE_THREADS = int(os.environ.get('TFLITE_THREADS', str(max(1, (os.cpu_count() or 1) // 2))))  # interpreter threads
+EMBEDDING_RUNTIME = f"tflite:{os.path.basename(ARCFACE_TFLITE)}" if ARCFACE_TFLITE else "keras"
+
+# Bulk enrollment (/upload_bulk/): one job at a time, images detected and embedded in batches
+BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', '16'))
+BULK_UPLOAD_WORKERS = int(os.environ.get('BULK_UPLOAD_WORKERS', '16'))  # parallel GCS uploads
+BULK_TIMEOUT = float(os.environ.get('BULK_TIMEOUT', '3600'))  # seconds per bulk request
+
+def model_fingerprint():
+    """Identifies how embeddings were produced; shards from other setups are ignored."""
+    try:
+        deepface_version = importlib.metadata.version('deepface')
+    except importlib.metadata.PackageNotFoundError:
+        deepface_version = 'unknown'
+    return f"{MODEL_NAME}|{DETECTOR_NAME}|align=True|deepface-{deepface_version}|{EMBEDDING_RUNTIME}"
+
+MODEL_FINGERPRINT = model_fingerprint()
+
 # Google CSE Config
 GOOGLE_CSE_API_KEY = ""
 GOOGLE_CSE_ID = ""
@@ -34,74 +143,434 @@ GOOGLE_CSE_ID = ""
 storage_client = None
 bucket = None
 try:
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(GCS_BUCKET_NAME)
-    print(f">>> Connected to GCS Bucket: {GCS_BUCKET_NAME}")
+    if GCS_LOCAL_BUCKET_DIR:
+        bucket = LocalBucket(GCS_LOCAL_BUCKET_DIR)
+        logger.info(f">>> Using local bucket stand-in: {GCS_LOCAL_BUCKET_DIR}")
+    else:
+        storage_client = storage.Client()
+        bucket = storage_client.bucket(GCS_BUCKET_NAME)
+        logger.info(f">>> Connected to GCS Bucket: {GCS_BUCKET_NAME}")
 except Exception as e:
-    print(f"⚠️ Error connecting to GCS: {e}")
+    logger.warning(f"⚠️ Error connecting to GCS: {e}")
+
+# Model singletons, built and warmed once by warm_models()
+arcface_model = None
+face_detector = make_detector(
+    DETECTOR_BACKEND,
+    fast_backend=DETECTOR_FAST_BACKEND,
+    min_confidence=DETECTOR_FAST_MIN_CONFIDENCE,
+    escalate_empty=DETECTOR_ESCALATE_EMPTY,
+    target_size=deepface_functions.find_target_size(MODEL_NAME)
+)
+
+# Readiness state reported by /ready
+service_state = {
+    "models_ready": False,
+    "gallery_ready": False,
+    "import_seconds": None,
+    "warmup_seconds": None,
+    "startup_error": None
+}
+
+inference_pool = InferencePool(
+    max_workers=INFERENCE_WORKERS,
+    max_queue=INFERENCE_QUEUE,
+    timeout=INFERENCE_TIMEOUT
+)
+bulk_pool = InferencePool(max_workers=1, max_queue=0, timeout=BULK_TIMEOUT)
+
+# Resident embedding gallery (loaded once at startup, matched in memory)
+gallery = FaceGallery(
+    threshold=MATCH_THRESHOLD,
+    index_factory=lambda embeddings, scales=None: make_index(
+        embeddings, SEARCH_BACKEND, ivf_min_size=IVF_MIN_SIZE, scales=scales, nprobe=IVF_NPROBE
+    ),
+    prototype_mode=GALLERY_PROTOTYPES
+)
+# Keyed by detector and runtime too: crops from another detector, or int8 TFLite embeddings,
+# must not mix with the current setup's
+embedding_cache = EmbeddingCache(
+    EMBEDDINGS_CACHE,
+    model_name=f"{MODEL_NAME}|{DETECTOR_NAME}" if not ARCFACE_TFLITE else f"{MODEL_NAME}|{DETECTOR_NAME}|{EMBEDDING_RUNTIME}"
+)
+gallery_file_info = {"path": GALLERY_FILE, "dtype": None, "version": None, "quantization": None}
+published_shard = {"version": None, "generation": None}  # last shard this instance loaded or uploaded
+result_cache = ResultCache(max_size=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+metrics = Metrics()
+
+def load_face_head():
+    """The optional classifier head, or None if unset, unreadable or built for another model."""
+    if not HEAD_PATH:
+        return None
+    try:
+        head = EmbeddingHead.load(HEAD_PATH)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not load classifier head {HEAD_PATH}: {e}")
+        return None
+    if head.model_name != MODEL_NAME:
+        logger.warning(f"⚠️ Classifier head was trained on {head.model_name} embeddings, not {MODEL_NAME}. Ignoring it.")
+        return None
+    if head.detector != DETECTOR_NAME:
+        logger.warning(f"⚠️ Classifier head was trained with detector {head.detector}, serving uses {DETECTOR_NAME}.")
+    logger.info(f">>> Classifier head loaded: {len(head.classes)} classes (min p={HEAD_MIN_PROBABILITY})")
+    return head
+
+face_head = load_face_head()
+profiler = SamplingProfiler(hz=PROFILER_HZ or 100)
+
+def get_arcface_model():
+    global arcface_model
+    if arcface_model is None:
+        if ARCFACE_TFLITE:
+            arcface_model = TFLiteModel(ARCFACE_TFLITE, num_threads=TFLITE_THREADS)
+            logger.info(f">>> ArcFace served from {ARCFACE_TFLITE} ({TFLITE_THREADS} threads)")
+        else:
+            arcface_model = DeepFace.build_model(MODEL_NAME)
+    return arcface_model
+
+def embed_batch(batch):
+    """One ArcFace forward pass over a (N, 112, 112, 3) batch of face crops."""
+    model = get_arcface_model()
+    if ARCFACE_TFLITE:
+        return model.predict(batch)
+    return model(batch, training=False).numpy()
+
+embedding_batcher = EmbeddingBatcher(embed_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+
+def embed_image(img):
+    """ArcFace embedding of the main face in img (file path or BGR array); ValueError if there is none."""
+    faces = face_detector.detect(img)
+    if not faces:
+        raise ValueError("No face detected.")
+    return embedding_batcher.embed([faces[0][0]])[0]
+
+def warm_models():
+    """Build ArcFace and the face detector(s) once and run a dummy inference through both."""
+    started = time.perf_counter()
+    get_arcface_model()
+    face_detector.warm()
+    face_detector.detect(np.zeros((224, 224, 3), dtype=np.uint8))
+    target_size = deepface_functions.find_target_size(MODEL_NAME)
+    embedding_batcher.embed([np.zeros((1, *target_size, 3), dtype=np.float32)])
+    service_state["models_ready"] = True
+    logger.info(f">>> Models warmed up ({MODEL_NAME} + {DETECTOR_NAME}) in {time.perf_counter() - started:.2f}s")
+
+def commit_gallery_change(change_fn):
+    """
+    Apply change_fn() (returns True if the gallery changed) under the
+    cross-worker gallery lock, on top of the newest shared gallery file;
+    then rewrite the file and bump the shared version so the other workers
+    reload it. The shard for new instances is uploaded by the leader's
+    next sync (publish_gallery_shard), not here.
 
-# Sync DB from GCS (Incremental)
+    The lock blocks every enrollment in every worker, so change_fn should
+    only merge: embed new images into embedding_cache before calling this.
+    """
+    with shared_gallery.write_lock():
+        embedding_cache.refresh()
+        changed = change_fn()
+        if changed:
+            embedding_cache.save()
+            publish_gallery_file()
+        return changed
+
+def object_path(label):
+    return os.path.join(OBJECTS_PATH, label_object(label))
+
+def sync_gallery_entries(entries):
+    """Bring the gallery in line with {label: md5} from a manifest (cache hits and known hashes are free)."""
+    return gallery.sync_entries(entries, OBJECTS_PATH, embed_image, embedding_cache, path_fn=object_path)
+
+def embed_missing(entries):
+    """
+    Embed every image of {label: md5} that neither the gallery nor the
+    cache knows into embedding_cache, outside the gallery lock (a cold
+    start can take minutes). Returns how many were embedded.
+    """
+    embedding_cache.refresh()
+    embedded = 0
+    for label, md5 in sorted(entries.items()):
+        if gallery.has_hash(md5) or md5 in embedding_cache:
+            continue
+        try:
+            embedding_cache.put(md5, embed_image(object_path(label)))
+            embedded += 1
+        except Exception as e:
+            # Left to the locked merge, which logs it and skips the image
+            logger.debug(f">>> Could not embed {label} ahead of the gallery update: {e}")
+    if embedded:
+        embedding_cache.save()
+        logger.info(f">>> Embedded {embedded} new images.")
+    return embedded
+
+def refresh_gallery():
+    """No bucket: the local manifest is the source of truth (images dropped flat into DB_PATH are imported)."""
+    def change():
+        manifest = Manifest.load(LOCAL_MANIFEST)
+        if import_legacy_files(DB_PATH, manifest, parse_identity_name):
+            manifest.save(LOCAL_MANIFEST)
+        return sync_gallery_entries(manifest.entries())
+    commit_gallery_change(change)
+
+# Sync DB from GCS (Incremental, parallel, content-addressed)
 def sync_db_from_gcs():
+    """
+    Mirrors the cloud content store into DB_PATH by diffing manifests,
+    skipping images whose embedding is already cached. Returns the
+    SyncResult ({label: md5} of the cloud DB in .remote), or None when
+    there is no bucket (DB_PATH is then the source of truth).
+    """
     if not bucket: 
-        print("⚠️ GCS Bucket not initialized. Skipping sync.")
-        return
+        logger.warning("⚠️ GCS Bucket not initialized. Skipping sync.")
+        return None
         
-    # print(">>> Checking for database updates from GCS...")
+    logger.debug(f">>> ☁️ Accessing GCS Bucket: {GCS_BUCKET_NAME}")
+    if bucket.get_blob(GCS_MANIFEST_BLOB) is None:
+        # First run on a bucket in the flat '<name>_<file>' layout
+        update_manifest(bucket, GCS_MANIFEST_BLOB,
+                        lambda manifest: import_legacy_blobs(bucket, GCS_DB_PREFIX, manifest, parse_identity_name) > 0)
+    logger.debug(f">>> 📂 Reading Cloud Manifest: {GCS_MANIFEST_BLOB} ...")
+    result = sync_manifest(
+        bucket,
+        GCS_DB_PREFIX,
+        DB_PATH,
+        max_workers=GCS_DOWNLOAD_WORKERS,
+        need_fn=lambda obj, md5: not (gallery.has_hash(md5) or md5 in embedding_cache)
+    )
+    logger.info(f">>> ✅ Found {len(result.remote)} images in Cloud Database ({len(result.skipped)} already embedded).")
+    for obj in result.removed:
+        logger.info(f">>> Removed deleted face: {obj}")
+    return result
+
+def sync_and_refresh():
+    with metrics.span("sync_download"):
+        result = sync_db_from_gcs()
+    with metrics.span("sync_embed"):
+        embed_missing(result.remote if result is not None else Manifest.load(LOCAL_MANIFEST).entries())
+    with metrics.span("sync_merge"):
+        if result is None:
+            refresh_gallery()
+        else:
+            commit_gallery_change(lambda: sync_gallery_entries(result.remote))
+    if result is not None and result.failed:
+        # Fail the sync so the syncer keeps the old fingerprint and retries these on its next check
+        raise RuntimeError(f"{len(result.failed)} image downloads failed: {', '.join(sorted(result.failed)[:5])}")
+    with metrics.span("shard_publish"):
+        publish_gallery_shard()
+
+def enroll_objects(pairs):
+    """
+    Name (safe_name, object) pairs in the manifest (the bucket's when there
+    is one) and add them to the gallery. Runs under the gallery lock;
+    returns True if anything was new.
+    """
+    add_all = lambda manifest: any([manifest.add(name, obj) for name, obj in pairs])
+    if bucket:
+        _, changed = update_manifest(bucket, GCS_MANIFEST_BLOB, add_all)
+    else:
+        manifest = Manifest.load(LOCAL_MANIFEST)
+        changed = add_all(manifest)
+        if changed:
+            manifest.save(LOCAL_MANIFEST)
+    if not changed:
+        return False
+    entries = {object_label(name, obj): object_hash(obj) for name, obj in pairs}
+    return gallery.update_entries(entries, OBJECTS_PATH, embed_image, embedding_cache, path_fn=object_path)
+
+def load_gallery_shard():
+    """
+    Cold start: load the published embedding shard (memory-mapped) so this
+    instance can serve without downloading or re-embedding any image.
+    Returns False if there is no shard or it was built with another model.
+    """
+    if not bucket:
+        return False
     try:
-        print(f">>> ☁️ Accessing GCS Bucket: {GCS_BUCKET_NAME}")
-        print(f">>> 📂 Scanning Cloud Folder: {GCS_DB_PREFIX} ...")
-        
-        # 1. List GCS blobs
-        blobs = list(bucket.list_blobs(prefix=GCS_DB_PREFIX))
-        remote_files = {os.path.basename(b.name) for b in blobs if not b.name.endswith('/') and not b.name.endswith('.pkl')}
-        
-        print(f">>> ✅ Found {len(remote_files)} images in Cloud Database.")
-        
-        if not os.path.exists(DB_PATH):
-            os.makedirs(DB_PATH)
-            
-        local_files = set(os.listdir(DB_PATH))
-        
-        changes_made = False
+        blob = bucket.get_blob(GCS_SHARD_BLOB)
+        if blob is None:
+            published_shard["generation"] = 0
+            logger.info(">>> No embedding shard published yet.")
+            return False
+        published_shard["generation"] = blob.generation
+        os.makedirs(os.path.dirname(GALLERY_FILE), exist_ok=True)
+        shard_path = f"{GALLERY_FILE}.shard"
+        download_atomic(blob, shard_path)
+        try:
+            header, embeddings, scales = read_shard(shard_path, mmap=True)
+            if header["fingerprint"] != MODEL_FINGERPRINT:
+                logger.info(f">>> Shard fingerprint {header['fingerprint']} != {MODEL_FINGERPRINT}. Re-embedding images.")
+                return False
+            # Renumbered when it is published as this instance's gallery file (see publish_gallery_file)
+            gallery.load_snapshot(embeddings, header["labels"], header["hashes"], scales=scales)
+        finally:
+            os.remove(shard_path)
+        logger.info(f">>> Loaded embedding shard v{header['version']} ({header['count']} faces, {header['dtype']}).")
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Could not load embedding shard: {e}")
+        return False
 
-        # 2. Download new files
-        for blob in blobs:
-            if blob.name.endswith('/') or blob.name.endswith('.pkl'): continue
-            filename = os.path.basename(blob.name)
-            local_path = os.path.join(DB_PATH, filename)
-            
-            if filename not in local_files:
-                blob.download_to_filename(local_path)
-                changes_made = True
-                print(f">>> Downloaded new face: {filename}")
-
-        # 3. Delete removed files (sync deletion)
-        for filename in local_files:
-            if filename not in remote_files and not filename.endswith('.pkl'):
-                os.remove(os.path.join(DB_PATH, filename))
-                changes_made = True
-                print(f">>> Removed deleted face: {filename}")
-
-        # 4. Clear DeepFace cache ONLY if changes occurred
-        if changes_made:
-            pkl_file = os.path.join(DB_PATH, "representations_arcface.pkl")
-            if os.path.exists(pkl_file):
-                os.remove(pkl_file)
-                print(">>> Database updated. Cleared DeepFace cache.")
-                
+def load_gallery_file():
+    """
+    Serve GALLERY_FILE (written by this or another worker) from a read-only
+    memory map. A file left over from another model/detector/runtime is
+    rejected: its rows would otherwise be reused by hash and mixed with ours.
+    """
+    header, embeddings, scales = read_shard(GALLERY_FILE, mmap=True)
+    if header["fingerprint"] != MODEL_FINGERPRINT:
+        raise ValueError(f"{GALLERY_FILE} was built for {header['fingerprint']}, not {MODEL_FINGERPRINT}")
+    # Same version number in every worker: the one the file was published under
+    gallery.load_snapshot(embeddings, header["labels"], header["hashes"], scales=scales, version=header["version"])
+    gallery_file_info.update(dtype=header["dtype"], version=header["version"], quantization=header.get("quantization"))
+    service_state["gallery_ready"] = True
+
+def publish_gallery_file():
+    """Write the gallery file as the next shared version and let the other workers reload it (under write_lock)."""
+    version = shared_gallery.next_version()
+    commit_gallery_file(version)
+    shared_gallery.publish(version)
+
+def commit_gallery_file(version):
+    """
+    Write the current gallery to GALLERY_FILE as GALLERY_DTYPE (with the
+    measured quantization error in its header) and switch the resident
+    gallery to a read-only memory map of that file, numbered `version`.
+    """
+    with metrics.span("gallery_commit"):
+        _commit_gallery_file(version)
+
+def _commit_gallery_file(version):
+    snapshot = gallery.snapshot
+    sample = np.sort(np.random.default_rng(0).choice(len(snapshot), min(5000, len(snapshot)), replace=False))
+    report = quantization_report(snapshot.rows_float32(sample), GALLERY_DTYPE)
+    write_shard(
+        GALLERY_FILE,
+        snapshot.embeddings,
+        snapshot.labels,
+        snapshot.hashes,
+        fingerprint=MODEL_FINGERPRINT,
+        version=version,
+        dtype=GALLERY_DTYPE,
+        model_name=MODEL_NAME,
+        scales=snapshot.scales,
+        extra={"quantization": report}
+    )
+    _, embeddings, scales = read_shard(GALLERY_FILE, mmap=True)
+    if gallery.swap_storage(snapshot.version, embeddings, scales, new_version=version):
+        gallery_file_info.update(dtype=GALLERY_DTYPE, version=version, quantization=report)
+        logger.info(f">>> Gallery file v{version} written ({GALLERY_DTYPE}, top-1 agreement {report['top1_agreement']:.2%}).")
+
+def publish_gallery_shard():
+    """
+    Leader, after each sync: upload the gallery file as the shard for new
+    instances if it changed since the last upload. The upload only replaces
+    the shard generation this instance last saw (if_generation_match, like
+    the manifest), so instances never blindly overwrite each other's shard;
+    after a conflict the next sync re-reads the generation and tries again.
+    """
+    if not bucket or shared_gallery.loaded_version in (None, published_shard["version"]):
+        return
+    generation = published_shard["generation"]
+    if generation is None:
+        current = bucket.get_blob(GCS_SHARD_BLOB)
+        generation = current.generation if current is not None else 0
+    # A hard link pins this version: a commit may replace GALLERY_FILE during the upload
+    upload_path = f"{GALLERY_FILE}.{os.getpid()}.upload"
+    os.link(GALLERY_FILE, upload_path)
+    try:
+        header = read_shard_header(upload_path)[0]
+        blob = bucket.blob(GCS_SHARD_BLOB)
+        blob.upload_from_filename(upload_path, if_generation_match=generation)
     except Exception as e:
-        print(f"❌ Error syncing from GCS: {e}")
-        traceback.print_exc()
+        if getattr(e, 'code', None) != 412:
+            raise
+        published_shard["generation"] = None
+        logger.info(">>> Another instance published the embedding shard first; retrying after the next sync.")
+        return
+    finally:
+        os.remove(upload_path)
+    published_shard.update(version=header["version"], generation=blob.generation)
+    logger.info(f">>> Published embedding shard v{header['version']} ({header['count']} faces).")
+
+# Background syncer: polls blob generations and only syncs when they change (leader worker only)
+syncer = GallerySyncer(
+    sync_fn=sync_and_refresh,
+    fingerprint_fn=(lambda: manifest_fingerprint(bucket, GCS_MANIFEST_BLOB)) if bucket else None,
+    interval=GCS_SYNC_INTERVAL,
+    on_synced=lambda timestamp: shared_gallery.record_sync(timestamp)
+)
+
+def become_leader():
+    """This worker syncs with the cloud for all of them; the others reload the shared gallery file."""
+    with shared_gallery.write_lock():
+        # Shard first (no image downloads), unless a previous leader already left a gallery file
+        if shared_gallery.loaded_version is None and load_gallery_shard():
+            publish_gallery_file()
+            published_shard["version"] = shared_gallery.loaded_version  # same rows as the bucket's shard
+    syncer.run_once(force=True)
+    with shared_gallery.write_lock():
+        if shared_gallery.loaded_version is None:
+            # Nothing changed on the first sync: still publish the (possibly empty) gallery for the followers
+            publish_gallery_file()
+    service_state["gallery_ready"] = True
+    syncer.start()
+
+# Gallery state shared by all gunicorn workers (see gunicorn.conf.py)
+shared_gallery = SharedGallery(
+    EMBEDDINGS_DIR,
+    reload_fn=load_gallery_file,
+    poll_interval=GALLERY_POLL_INTERVAL,
+    on_leader=become_leader
+)
+
+def register_metrics():
+    """Gauges and component counters, read at scrape time."""
+    metrics.register("gallery_size", lambda: len(gallery), "Enrolled images in the gallery.")
+    metrics.register("gallery_identities", lambda: gallery.identity_count, "Distinct identities in the gallery.")
+    metrics.register("gallery_version", lambda: gallery.version, "Shared gallery version being served (same in every worker).")
+    metrics.register("gallery_staleness_seconds", shared_gallery.staleness,
+                     "Seconds since the leader worker's last successful cloud sync.")
+    metrics.register("gallery_syncs_total", lambda: syncer.sync_count, "Cloud syncs that ran.", kind="counter")
+    metrics.register("gallery_shared_version", lambda: shared_gallery.loaded_version or 0,
+                     "Shared gallery file version loaded by this worker.")
+    metrics.register("gallery_reloads_total", lambda: shared_gallery.reloads,
+                     "Gallery files published by other workers and reloaded here.", kind="counter")
+    metrics.register("gallery_leader", lambda: int(shared_gallery.is_leader), "1 in the worker that runs the cloud sync.")
+    metrics.register("ready", lambda: int(service_state["models_ready"] and service_state["gallery_ready"]),
+                     "1 once models and gallery are loaded.")
+    metrics.register("result_cache_hits_total", lambda: result_cache.hits, "Result cache hits.", kind="counter")
+    metrics.register("result_cache_misses_total", lambda: result_cache.misses, "Result cache misses.", kind="counter")
+    metrics.register("result_cache_size", lambda: len(result_cache), "Entries in the result cache.")
+    metrics.register("embedding_cache_size", lambda: len(embedding_cache), "Cached embeddings by content hash.")
+    metrics.register("inference_queue_depth", lambda: inference_pool.pending, "Inference jobs running or waiting.")
+    metrics.register("inference_rejected_total", lambda: inference_pool.rejected, "Requests rejected with 429.", kind="counter")
+    metrics.register("inference_timed_out_total", lambda: inference_pool.timed_out, "Requests that timed out (504).", kind="counter")
+    metrics.register("embedding_batch_queue_depth", lambda: embedding_batcher.queue_depth, "Embedding jobs waiting for a batch.")
+    metrics.register("embedding_batches_total", lambda: embedding_batcher.batches, "Batched embedding forward passes.", kind="counter")
+    metrics.register("embedding_batch_items_total", lambda: embedding_batcher.items, "Face crops embedded.", kind="counter")
+    if hasattr(face_detector, "escalated"):
+        metrics.register("detector_escalations_total", lambda: face_detector.escalated,
+                         "Images escalated from the fast to the accurate detector.", kind="counter")
 
+register_metrics()
 
+def gallery_status(snapshot=None):
+    snapshot = snapshot if snapshot is not None else gallery.snapshot
+    staleness = shared_gallery.staleness()  # written by whichever worker runs the syncer
+    return {
+        "gallery_version": snapshot.version,
+        "gallery_size": len(snapshot),
+        "gallery_identities": len(snapshot.identity_names),
+        "gallery_staleness_s": round(staleness, 2) if staleness is not None else None
+    }
 
 # Inicializar Google CSE API
 google_cse = None
 try:
     google_cse = GoogleCSEAPI(api_key=GOOGLE_CSE_API_KEY, cse_id=GOOGLE_CSE_ID)
-    print(">>> Google CSE API inicializada correctamente")
+    logger.info(">>> Google CSE API inicializada correctamente")
 except Exception as e:
-    print(f"⚠️ Error inicializando Google CSE API: {e}")
+    logger.warning(f"⚠️ Error inicializando Google CSE API: {e}")
     traceback.print_exc()
 
 app = FastAPI(title="CPU Neural API v2 (DeepFace + GCS)")
@@ -113,10 +582,50 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Perform initial sync on startup
+def warm_up_service():
+    """Models, then gallery; /ready turns green only once both are loaded."""
+    started = time.perf_counter()
+    try:
+        warm_models()
+        try:
+            if not shared_gallery.take_leadership():
+                logger.info(f">>> Worker {os.getpid()} follows the gallery leader.")
+        finally:
+            # The watcher reloads every new version and takes over (or retries) leadership
+            shared_gallery.start()
+        if not shared_gallery.is_leader and not shared_gallery.wait_for_version(timeout=GALLERY_WAIT_TIMEOUT):
+            # Keeps waiting in the background: /ready turns green once a gallery is published
+            raise TimeoutError(f"No gallery published by the leader after {GALLERY_WAIT_TIMEOUT:.0f}s.")
+    except Exception as e:
+        service_state["startup_error"] = str(e)
+        logger.error(f"❌ Warm-up failed: {e}")
+        traceback.print_exc()
+    service_state["warmup_seconds"] = round(time.perf_counter() - started, 2)
+
+# Warm up in the background so the port opens right away and /ready gates traffic
 @app.on_event("startup")
 async def startup_event():
-    sync_db_from_gcs()
+    if PROFILER_HZ > 0:
+        profiler.start()
+    threading.Thread(target=warm_up_service, name="warm-up", daemon=True).start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    syncer.stop()
+    shared_gallery.stop()
+    profiler.stop()
+    inference_pool.shutdown()
+    bulk_pool.shutdown()
+
+async def run_inference(fn, *args, pool=None):
+    """Dispatch blocking work to the inference pool, mapping overload to HTTP errors."""
+    pool = pool or inference_pool
+    try:
+        return await pool.run(fn, *args)
+    except PoolSaturated:
+        raise HTTPException(status_code=429, detail="Inference queue is full, retry later.")
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Inference timed out after {pool.timeout:.0f}s.")
 
 @app.get("/")
 async def root():
@@ -124,115 +633,282 @@ async def root():
 
 @app.post("/upload_data/")
 async def upload_data(file: UploadFile = File(...), name: str = Form(...)):
+    contents = await file.read()
+    return await run_inference(enroll_face, contents, file.filename, name)
+
+def enroll_face(contents, original_filename, name):
+    """Blocking part of /upload_data/ (runs on the inference pool)."""
+    with metrics.trace("upload_data") as timings:
+        result = _enroll_face(contents, original_filename, name)
+    logger.debug(json.dumps({"endpoint": "upload_data", "timings_ms": timings}))
+    return result
+
+def _enroll_face(contents, original_filename, name):
     try:
-        # Sanitize name
-        safe_name = "".join([c for c in name if c.isalpha() or c.isdigit() or c==' ']).rstrip()
-        filename = f"{safe_name}_{file.filename}"
-        local_path = os.path.join(DB_PATH, filename)
-        
-        # 1. Save locally
-        with open(local_path, "wb+") as file_object:
-            file_object.write(file.file.read())
+        # Sanitize name; the image is stored under its content hash
+        safe_name, obj, _ = enrollment_entry(name, original_filename, contents)
+        content_hash = object_hash(obj)
+
+        # 1. Embed, unless these exact bytes were enrolled before (under any name)
+        if not (gallery.has_hash(content_hash) or content_hash in embedding_cache):
+            with metrics.span("embed"):
+                embedding_cache.put(content_hash, embed_image(decode_image(contents)))
+
+        # 2. Save locally (no-op for known content)
+        local_path = write_object(OBJECTS_PATH, obj, contents)
             
-        # 2. Upload to GCS
+        # 3. Upload to GCS
         if bucket:
-            blob = bucket.blob(f"{GCS_DB_PREFIX}{filename}")
-            blob.upload_from_filename(local_path)
-            print(f">>> Uploaded {filename} to GCS.")
-
-        # Clear DeepFace representations cache to force reload
-        pkl_file = os.path.join(DB_PATH, "representations_arcface.pkl")
-        if os.path.exists(pkl_file):
-            os.remove(pkl_file)
+            with metrics.span("upload"):
+                upload_to_bucket(obj, local_path)
+            logger.debug(f">>> Uploaded {obj} to GCS.")
+
+        # Name it in the manifest, append it to the gallery and share the result
+        with metrics.span("gallery_update"):
+            changed = commit_gallery_change(lambda: enroll_objects([(safe_name, obj)]))
+        if not changed:
+            return {"status": "success", "message": f"This image of '{safe_name}' was already in the database."}
             
         return {"status": "success", "message": f"Face for '{safe_name}' added to database (Cloud Persisted)."}
     except Exception as e:
-        print(f"Upload Error: {e}")
+        logger.error(f"Upload Error: {e}")
+        metrics.inc("errors_total", help_text="Requests answered with an error.", endpoint="upload_data")
         return {"error": str(e)}
 
+@app.post("/upload_bulk/")
+async def upload_bulk(files: List[UploadFile] = File(...), manifest: str = Form(None)):
+    """
+    Bulk enrollment: zip archives (one folder per person or a manifest.json)
+    and/or plain images, with an optional JSON manifest {filename: name}.
+    """
+    try:
+        names = json.loads(manifest) if manifest else {}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid manifest: {e}")
+    images = [f for f in files if not f.filename.lower().endswith('.zip')]
+    if images and not names:
+        raise HTTPException(status_code=400, detail="Plain images need a manifest {filename: name} "
+                                                    "(or send a zip with one folder per person).")
+    # The job gets its own copies: FastAPI closes the uploads when the request ends, even on a 504
+    archives = [await spool_upload(f) for f in files if f.filename.lower().endswith('.zip')]
+    uploads = [(f.filename, await spool_upload(f)) for f in images]
+    try:
+        return await run_inference(bulk_enroll_faces, archives, uploads, names, pool=bulk_pool)
+    except HTTPException as e:
+        if e.status_code == 429:
+            # The job never started, so it will not close them
+            close_all(archives + [f for _, f in uploads])
+        raise
+
+async def spool_upload(upload, chunk_size=1 << 20):
+    """Copy an upload into an anonymous temp file (positioned at the start)."""
+    spooled = tempfile.TemporaryFile()
+    while chunk := await upload.read(chunk_size):
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
+
+def close_all(files):
+    for f in files:
+        f.close()
+
+def upload_to_bucket(obj, local_path):
+    """Upload an image to the content store; identical bytes are already there under the same name."""
+    blob = bucket.blob(f"{GCS_OBJECTS_PREFIX}{obj}")
+    if not blob.exists():
+        blob.upload_from_filename(local_path)
+
+def bulk_enroll_faces(archives, uploads, names):
+    """Blocking part of /upload_bulk/: every enrolled image lands in one gallery commit."""
+    try:
+        with metrics.trace("upload_bulk") as timings:
+            result = _bulk_enroll_faces(archives, uploads, names)
+    finally:
+        close_all(archives + [f for _, f in uploads])
+    logger.debug(json.dumps({"endpoint": "upload_bulk", "timings_ms": timings}))
+    return result
+
+def _bulk_enroll_faces(archives, uploads, names):
+    started = time.perf_counter()
+    items = itertools.chain(*[iter_archive(f, names) for f in archives], iter_uploads(uploads, names))
+    pipeline = BulkEnrollment(
+        OBJECTS_PATH,
+        detect_fn=face_detector.detect,
+        embed_fn=embedding_batcher.embed,
+        cache=embedding_cache,
+        upload_fn=upload_to_bucket if bucket else None,
+        known_fn=lambda md5: gallery.has_hash(md5) or md5 in embedding_cache,
+        batch_size=BULK_BATCH_SIZE,
+        upload_workers=BULK_UPLOAD_WORKERS
+    )
+    try:
+        with metrics.span("bulk_pipeline"):
+            results = pipeline.run(items)
+    except Exception as e:
+        logger.error(f"Bulk Upload Error: {e}")
+        return {"error": str(e)}
+
+    enrolled = [(r["name"], r["object"]) for r in results if r["status"] == "enrolled"]
+    metrics.inc("bulk_items_total", len(enrolled), "Images processed by bulk enrollment.", status="enrolled")
+    metrics.inc("bulk_items_total", len(results) - len(enrolled), status="failed")
+    if enrolled:
+        with metrics.span("gallery_update"):
+            commit_gallery_change(lambda: enroll_objects(enrolled))
+    logger.info(f">>> Bulk enrollment: {len(enrolled)}/{len(results)} images in {time.perf_counter() - started:.1f}s")
+    return {
+        "status": "success" if len(enrolled) == len(results) else "partial",
+        "enrolled": len(enrolled),
+        "failed": len(results) - len(enrolled),
+        "seconds": round(time.perf_counter() - started, 2),
+        "items": results,
+        **gallery_status()
+    }
+
 @app.post("/predict/")
 async def predict(file: UploadFile = File(...)):
-    # Guardar temporalmente
-    file_location = os.path.join(UPLOAD_DIR, file.filename)
-    
-    with open(file_location, "wb+") as file_object:
-        file_object.write(file.file.read())
+    contents = await file.read()
+    return await run_inference(identify_face, contents)
 
+def identify_face(contents):
+    """Blocking part of /predict/ (runs on the inference pool)."""
+    with metrics.trace("predict") as timings:
+        result = _identify_face(contents)
+    logger.debug(json.dumps({"endpoint": "predict", "identified_name": result.get("identified_name"),
+                             "cached": result.get("cached"), "timings_ms": timings}))
+    return {**result, "timings_ms": timings}
+
+def describe_match(match, classified=None):
+    """Response fields for one face: classifier answer, gallery match or unknown."""
+    if classified is not None:
+        identified_name, probability, (_, filename, distance) = classified
+        return {
+            "identified_name": identified_name,
+            "confidence": f"{probability:.2%}",
+            "system_log": f"Classifier head: {identified_name} (p={probability:.4f}), verified on {filename} (Dist: {distance:.4f})",
+            "distance": round(distance, 4),
+            "classifier": True
+        }
+    if match is not None:
+        # Names come from the gallery's identity table (resolved once at enrollment)
+        identified_name, filename, distance = match
+
+        # Calculate confidence from distance (lower distance = higher confidence)
+        # ArcFace cosine threshold is 0.68
+        # Simple inversion for display purposes (not scientifically accurate probability)
+        confidence_score = max(0, 1 - distance)
+
+        return {
+            "identified_name": identified_name,
+            "confidence": f"{confidence_score:.2%}",
+            "system_log": f"Match found: {filename} (Dist: {distance:.4f})",
+            "distance": round(distance, 4)
+        }
+    return {
+        "identified_name": "UNKNOWN_TARGET",
+        "confidence": "0.00%",
+        "system_log": "No match found in database."
+    }
+
+def identify_embeddings(embeddings, snapshot):
+    """
+    describe_match() for each face embedding: a confident classifier head
+    answer confirmed by that person's gallery images skips the search; the
+    rest are matched against the whole gallery (all against `snapshot`).
+    """
+    classified = [None] * len(embeddings)
+    if face_head is not None:
+        with metrics.span("classify"):
+            predictions = [face_head.predict(l2_normalize(embedding)) for embedding in embeddings]
+            confident = [i for i, (_, probability) in enumerate(predictions) if probability >= HEAD_MIN_PROBABILITY]
+            verified = gallery.verify_many(embeddings[confident], [predictions[i][0] for i in confident], snapshot)
+            for i, match in zip(confident, verified):
+                if match is not None:
+                    classified[i] = (*predictions[i], match)
+    to_search = [i for i, c in enumerate(classified) if c is None]
+    matches = [None] * len(embeddings)
+    if to_search:
+        with metrics.span("search"):
+            for i, match in zip(to_search, gallery.match_many(embeddings[to_search], snapshot)):
+                matches[i] = match
+    return [describe_match(m, c) for m, c in zip(matches, classified)]
+
+def _identify_face(contents):
     try:
-        # ALWAYS Sync with Cloud DB before prediction to ensure real-time results
-        sync_db_from_gcs()
+        # Cloud sync runs in the background; search (and cache against) whatever snapshot is published now
+        snapshot = gallery.snapshot
+        status = gallery_status(snapshot)
 
         # Check if DB is empty
-        if not os.path.exists(DB_PATH) or not os.listdir(DB_PATH):
+        if len(snapshot) == 0:
              return {
                  "identified_name": "UNKNOWN_TARGET",
                  "confidence": "0.00%",
-                 "system_log": "Database is empty. Upload faces first."
+                 "system_log": "Database is empty. Upload faces first.",
+                 **status
              }
 
-        # DeepFace Find (Regression/Embedding Comparison)
-        print(f">>> 📂 Local DB Content: {os.listdir(DB_PATH)}")
-        
-        # This compares the uploaded image against all images in DB_PATH
-        dfs = DeepFace.find(
-            img_path=file_location, 
-            db_path=DB_PATH, 
-            model_name='ArcFace',
-            detector_backend='ssd',
-            enforce_detection=False, 
-            silent=True
-        )
+        # Resubmitted image? Serve the result computed against this gallery version
+        version = snapshot.version
+        cache_keys = [hashlib.md5(contents).hexdigest()]
+        cached = result_cache.get(cache_keys[0], version)
+        if cached is not None:
+            return {**cached, **status, "cached": True}
+
+        # Directory listing only at DEBUG: it costs O(gallery) per request
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f">>> 📂 Local DB Content: {os.listdir(DB_PATH)}")
         
-        if len(dfs) > 0 and not dfs[0].empty:
-            match = dfs[0].iloc[0]
-            identity_path = match['identity']
-            filename = os.path.basename(identity_path)
-            
-            # Extract name from filename (e.g., "Vladimir_Putin.jpg" -> "Vladimir Putin")
-            base = os.path.splitext(filename)[0]
-            
-            # Clean up name
-            if base.endswith("_db_image"):
-                identified_name = base[:-9]
-            elif base.endswith("_db"):
-                identified_name = base[:-3]
-            else:
-                parts = base.rsplit('_', 1)
-                if len(parts) > 1:
-                    identified_name = parts[0]
-                else:
-                    identified_name = base
-            
-            identified_name = identified_name.replace("_", " ").strip()
+        # The probe is decoded in memory, never written to disk
+        with metrics.span("decode"):
+            probe, probe_scale = decode_image(contents, max_side=PROBE_MAX_SIDE, return_scale=True)
 
-            # Calculate confidence from distance (lower distance = higher confidence)
-            # SFace threshold is usually around 0.5-0.6
-            distance = match['distance']
-            # Simple inversion for display purposes (not scientifically accurate probability)
-            confidence_score = max(0, 1 - distance) 
-            
-            return {
-                "identified_name": identified_name,
-                "confidence": f"{confidence_score:.2%}",
-                "system_log": f"Match found: {filename} (Dist: {distance:.4f})"
-            }
-        else:
-            return {
+        if RESULT_CACHE_PERCEPTUAL:
+            cache_keys.append(f"p:{perceptual_hash(probe)}")
+            cached = result_cache.get(cache_keys[1], version)
+            if cached is not None:
+                result_cache.put(cache_keys[0], version, cached)
+                return {**cached, **status, "cached": True}
+
+        # One detection pass finds every face; no face: answer right away instead of embedding the whole image
+        with metrics.span("detect"):
+            faces = face_detector.detect(probe)[:PROBE_MAX_FACES]
+
+        if not faces:
+            result = {
                 "identified_name": "UNKNOWN_TARGET",
                 "confidence": "0.00%",
-                "system_log": "No match found in database."
+                "system_log": "No face detected in image.",
+                "face_detected": False,
+                "face_count": 0,
+                "faces": []
             }
+        else:
+            # All faces are embedded as one batch and searched against the same gallery snapshot
+            with metrics.span("embed"):
+                embeddings = embedding_batcher.embed([face[0] for face in faces])
+            results = identify_embeddings(embeddings, snapshot)
+
+            face_results = []
+            for (_, area, detection_confidence), face_result in zip(faces, results):
+                box = {k: int(round(area[k] / probe_scale)) for k in ("x", "y", "w", "h")}
+                face_results.append({"box": box, "detection_confidence": round(float(detection_confidence or 0), 4),
+                                     **face_result})
+
+            # Top-level fields describe the most confident face, as before
+            result = {**results[0], "face_count": len(faces), "faces": face_results}
+
+        for key in cache_keys:
+            result_cache.put(key, version, result)
+        return {**result, **status, "cached": False}
 
     except Exception as e:
-        print(f"Prediction Error: {e}")
+        logger.error(f"Prediction Error: {e}")
+        metrics.inc("errors_total", help_text="Requests answered with an error.", endpoint="predict")
         return {
             "identified_name": "ERROR",
             "confidence": "0.00%",
             "system_log": str(e)
         }
-    finally:
-        if os.path.exists(file_location):
-            os.remove(file_location)
 
 @app.post("/osint/")
 async def osint_search(query: dict):
@@ -240,7 +916,7 @@ async def osint_search(query: dict):
     if not target:
         return {"error": "Query empty"}
     
-    print(f">>> Buscando en OSINT (Google CSE): {target}")
+    logger.debug(f">>> Buscando en OSINT (Google CSE): {target}")
     
     if not google_cse:
         return {"error": "Google CSE API not initialized"}
@@ -272,7 +948,7 @@ async def osint_search(query: dict):
         }
 
     except Exception as e:
-        print(f"Error OSINT: {e}")
+        logger.error(f"Error OSINT: {e}")
         return {"error": str(e)}
 
 @app.get("/api/debug")
@@ -316,14 +992,52 @@ async def debug_system():
     # 2. Check Local DB
     try:
         if os.path.exists(DB_PATH):
-            status["local_db_files"] = os.listdir(DB_PATH)
+            status["local_db_files"] = os.listdir(OBJECTS_PATH) if os.path.exists(OBJECTS_PATH) else []
+            status["local_manifest_images"] = len(Manifest.load(LOCAL_MANIFEST))
         else:
             status["errors"].append("Local DB directory missing")
     except Exception as e:
         status["errors"].append(f"Local DB Error: {str(e)}")
 
+    status.update(gallery_status())
+    status["last_sync_error"] = syncer.last_error
+    status["result_cache"] = result_cache.stats()
+    status["search_backend"] = gallery.snapshot.index.kind
+    status["search_recall_at_1"] = gallery.index_recall()
+    status["gallery_file"] = gallery_file_info
+    status["face_detector"] = face_detector.stats()
+    status["embedding_runtime"] = EMBEDDING_RUNTIME
+    status["classifier_head"] = {"path": HEAD_PATH, "classes": len(face_head.classes)} if face_head else None
+    status["worker"] = shared_gallery.stats()
     return status
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint (text exposition format)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/profile")
+async def sample_profile(seconds: float = 5.0, top: int = 50):
+    """
+    Collapsed stacks (flamegraph.pl / speedscope format) from the sampling
+    profiler: the continuous profile when PROFILER_HZ is set, otherwise a
+    fresh `seconds`-long sample taken now.
+    """
+    loop = asyncio.get_running_loop()
+    if profiler.running:
+        stacks = profiler.collapsed(top)
+    else:
+        await loop.run_in_executor(None, profiler.profile_for, min(seconds, 60.0))
+        stacks = profiler.collapsed(top)
+    return PlainTextResponse(stacks + "\n")
+
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: 200 only once models and gallery are loaded."""
+    ready = service_state["models_ready"] and service_state["gallery_ready"]
+    body = {"ready": ready, **service_state, **gallery_status()}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
 # --- SERVING FRONTEND (AFTER API ROUTES) ---
 app.mount("/static", StaticFiles(directory="static/static"), name="static")
 
@@ -334,6 +1048,9 @@ async def serve_react_app(full_path: str):
         return FileResponse(static_file_path)
     return FileResponse("static/index.html")
 
+service_state["import_seconds"] = round(time.perf_counter() - _IMPORT_STARTED, 2)
+logger.info(f">>> main.py imported in {service_state['import_seconds']:.2f}s")
+
 if __name__ == '__main__':
-    print(">>> Iniciando Servidor en Modo CPU (DeepFace + GCS)...")
+    logger.info(">>> Iniciando Servidor en Modo CPU (DeepFace + GCS)...")
     uvicorn.run(app, host="0.0.0.0", port=8000)
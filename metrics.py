@@ -0,0 +1,147 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Latency buckets (seconds) shared by every stage histogram
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Minimal Prometheus-style registry plus per-request timing spans.
+
+    Counters and histograms are owned here; gauges (and counters kept by
+    other components, like cache hits) are read through callbacks at
+    scrape time. `trace()` opens a request on the current thread and every
+    `span()` inside it is both observed into the stage histogram and
+    recorded on that request, so callers get per-request stage timings.
+    """
+
+    def __init__(self, namespace='bionicscan'):
+        self.namespace = namespace
+        self._counters = {}
+        self._histograms = {}
+        self._callbacks = {}
+        self._help = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _name(self, name):
+        return f"{self.namespace}_{name}"
+
+    def inc(self, name, amount=1, help_text='', **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(self._name(name), help_text)
+            series = self._counters.setdefault(self._name(name), {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, help_text='', **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(self._name(name), help_text)
+            series = self._histograms.setdefault(self._name(name), {})
+            series.setdefault(key, Histogram()).observe(value)
+
+    def register(self, name, fn, help_text='', kind='gauge'):
+        """fn() returns a number, or {(('label', 'value'), ...): number} for labelled series."""
+        self._callbacks[self._name(name)] = (kind, fn)
+        self._help[self._name(name)] = help_text
+
+    @contextmanager
+    def trace(self, endpoint):
+        """Per-request scope; yields the {stage: ms} dict the request's spans fill in."""
+        spans = {}
+        previous = getattr(self._local, 'spans', None)
+        self._local.spans = spans
+        started = time.perf_counter()
+        status = 'ok'
+        try:
+            yield spans
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            self._local.spans = previous
+            elapsed = time.perf_counter() - started
+            spans['total'] = round(1000 * elapsed, 3)
+            self.observe('request_seconds', elapsed, help_text='End-to-end request latency.', endpoint=endpoint)
+            self.inc('requests_total', help_text='Requests handled.', endpoint=endpoint, status=status)
+
+    @contextmanager
+    def span(self, stage):
+        """Times one pipeline stage (decode, detect, embed, search, sync, ...)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe('stage_seconds', elapsed, help_text='Latency of one pipeline stage.', stage=stage)
+            spans = getattr(self._local, 'spans', None)
+            if spans is not None:
+                spans[stage] = round(spans.get(stage, 0.0) + 1000 * elapsed, 3)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+
+        def header(name, kind):
+            if self._help.get(name):
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: dict(series) for name, series in self._histograms.items()}
+
+        for name, series in sorted(counters.items()):
+            header(name, 'counter')
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for name, series in sorted(histograms.items()):
+            header(name, 'histogram')
+            for labels, hist in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(hist.buckets + (float('inf'),), hist.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+
+        for name, (kind, fn) in sorted(self._callbacks.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            header(name, kind)
+            series = value if isinstance(value, dict) else {(): value}
+            for labels, v in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(labels)} {float(v)!r}")
+        return "\n".join(lines) + "\n"
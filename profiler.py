@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+
+class SamplingProfiler:
+    """
+    Low-overhead wall-clock sampling profiler (pure Python).
+
+    A background thread snapshots every thread's stack `hz` times per
+    second via sys._current_frames() and counts collapsed stacks
+    ("file:function;file:function;..."), the input format of
+    flamegraph.pl / speedscope. Native TensorFlow time shows up under the
+    Python frame that called into it.
+    """
+
+    def __init__(self, hz=100, max_depth=64):
+        self.hz = hz
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def _collapse(self, frame):
+        parts = []
+        while frame is not None and len(parts) < self.max_depth:
+            code = frame.f_code
+            parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(parts))
+
+    def _loop(self):
+        own = threading.get_ident()
+        interval = 1.0 / self.hz
+        while not self._stop.wait(interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = [f"{names.get(ident, ident)};{self._collapse(frame)}"
+                      for ident, frame in sys._current_frames().items() if ident != own]
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def collapsed(self, top=None):
+        """'stack count' lines, most frequent first."""
+        with self._lock:
+            items = self._stacks.most_common(top)
+        return "\n".join(f"{stack} {count}" for stack, count in items)
+
+    def profile_for(self, seconds):
+        """Sample for `seconds` (only if not already running continuously) and return the collapsed stacks."""
+        if self.running:
+            return self.collapsed()
+        self.reset()
+        self.start()
+        time.sleep(seconds)
+        self.stop()
+        return self.collapsed()
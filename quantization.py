@@ -0,0 +1,75 @@
+import numpy as np
+
+STORAGE_DTYPES = ('float32', 'float16', 'int8')
+
+
+def quantize(embeddings, dtype):
+    """
+    Compress L2-normalized float32 rows. Returns (data, scales): float16 is
+    a plain cast (scales None); int8 is symmetric per-row quantization with
+    one float32 scale per row, so row ~= data * scale.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dtype == 'float32':
+        return np.ascontiguousarray(embeddings), None
+    if dtype == 'float16':
+        return embeddings.astype(np.float16), None
+    if dtype == 'int8':
+        scales = np.abs(embeddings).max(axis=1) / 127.0 if len(embeddings) else np.zeros(0, dtype=np.float32)
+        scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+        data = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+        return data, scales
+    raise ValueError(f"Unsupported storage dtype: {dtype}")
+
+
+def dequantize(data, scales=None):
+    """float32 copy of (a slice of) quantized rows."""
+    rows = np.asarray(data, dtype=np.float32)
+    if scales is not None:
+        rows = rows * np.asarray(scales, dtype=np.float32)[:, None]
+    return rows
+
+
+def cosine_scores(data, query, scales=None, chunk_rows=8192):
+    """
+    data @ query for float32, float16 or int8 rows. Quantized matrices are
+    processed in chunks so only `chunk_rows` rows are ever upcast at once;
+    int8 rows are rescaled after the dot product (one multiply per row).
+    """
+    query = np.asarray(query, dtype=np.float32)
+    if data.dtype == np.float32:
+        return data @ query
+    scores = np.empty(len(data), dtype=np.float32)
+    for start in range(0, len(data), chunk_rows):
+        stop = start + chunk_rows
+        scores[start:stop] = data[start:stop].astype(np.float32) @ query
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+def quantization_report(embeddings, dtype, n_rows=5000, n_queries=100, seed=0):
+    """
+    Measured accuracy delta of storing `embeddings` as dtype: absolute
+    cosine error over sampled row/query pairs and top-1 agreement with
+    float32 search (queries are noisy copies of gallery rows).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if len(embeddings) == 0 or dtype == 'float32':
+        return {"dtype": dtype, "max_abs_error": 0.0, "mean_abs_error": 0.0, "top1_agreement": 1.0}
+    rng = np.random.default_rng(seed)
+    rows = embeddings[rng.choice(len(embeddings), min(n_rows, len(embeddings)), replace=False)]
+    queries = rows[rng.choice(len(rows), min(n_queries, len(rows)), replace=False)]
+    queries = queries + rng.normal(0, 0.05, queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    data, scales = quantize(rows, dtype)
+    exact = queries @ rows.T
+    approx = np.stack([cosine_scores(data, q, scales) for q in queries])
+    error = np.abs(exact - approx)
+    return {
+        "dtype": dtype,
+        "max_abs_error": round(float(error.max()), 6),
+        "mean_abs_error": round(float(error.mean()), 6),
+        "top1_agreement": round(float(np.mean(exact.argmax(axis=1) == approx.argmax(axis=1))), 4),
+    }
@@ -0,0 +1,84 @@
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import cv2
+
+
+def perceptual_hash(img, hash_size=8):
+    """64-bit difference hash (dHash) of a BGR image, as hex."""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return f"{int(np.packbits(bits).view('>u8')[0]):016x}"
+
+
+class ResultCache:
+    """
+    LRU cache (size + TTL bounded) of /predict/ results keyed by image hash.
+
+    Every entry belongs to one gallery version; as soon as a lookup comes in
+    with a newer version the whole cache is dropped, so a result can never
+    outlive the gallery snapshot it was computed against. The version only
+    moves forward: a request still working on an older snapshot misses and
+    its put is ignored, instead of dropping the newer entries.
+    """
+
+    def __init__(self, max_size=1024, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _check_version(self, version):
+        """False if version is older than the cache's; a newer one drops every entry."""
+        if self._version is not None and version < self._version:
+            return False
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+        return True
+
+    def get(self, key, version):
+        if self.max_size <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key) if self._check_version(version) else None
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if not self._check_version(version):
+                return
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
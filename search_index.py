@@ -0,0 +1,195 @@
+import numpy as np
+from quantization import cosine_scores, dequantize
+
+
+class BruteForceIndex:
+    """
+    Exact cosine search: one matrix-vector product over every row (default).
+    Rows may be float32, float16 or int8 (with per-row scales).
+    """
+
+    kind = 'exact'
+
+    def __init__(self, embeddings, scales=None):
+        self.embeddings = embeddings
+        self.scales = scales
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def updated(self, embeddings, keep, n_new):
+        """Index for the next snapshot (kept rows first, then n_new appended rows)."""
+        return BruteForceIndex(embeddings)
+
+    def rebuilt(self, embeddings, scales=None):
+        """Index over a completely new set of rows."""
+        return BruteForceIndex(embeddings, scales)
+
+    def search(self, query, k=1):
+        """Returns (row_indices, cosine_distances) of the k nearest rows, closest first."""
+        if len(self.embeddings) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        distances = 1.0 - cosine_scores(self.embeddings, query, self.scales)
+        k = min(k, len(distances))
+        top = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        top = top[np.argsort(distances[top])]
+        return top, distances[top]
+
+
+def _kmeans(embeddings, nlist, iters=10, seed=0):
+    """Spherical k-means on L2-normalized rows; returns normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = embeddings[rng.choice(len(embeddings), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assignments = np.argmax(embeddings @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, embeddings)
+        counts = np.bincount(assignments, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = embeddings[rng.choice(len(embeddings), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate index (pure NumPy).
+
+    Rows are clustered around `nlist` k-means centroids; a query only scans
+    the rows of its `nprobe` closest centroids. Inserts are assigned to the
+    existing centroids and deletes just drop their assignment, so snapshot
+    updates stay incremental; centroids are retrained once the gallery has
+    grown to `retrain_factor` times the size they were trained on.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, embeddings, nlist=None, nprobe=8, centroids=None, assignments=None,
+                 trained_size=None, retrain_factor=2.0, scales=None):
+        self.embeddings = embeddings
+        self.scales = scales
+        self.nprobe = nprobe
+        self.retrain_factor = retrain_factor
+        if centroids is None:
+            nlist = nlist or max(1, int(np.sqrt(len(embeddings))))
+            centroids = _kmeans(dequantize(embeddings, scales), min(nlist, len(embeddings)))
+            assignments = None
+            trained_size = len(embeddings)
+        self.centroids = centroids
+        self.trained_size = trained_size
+        if assignments is None:
+            assignments = self._assign_all()
+        self.assignments = assignments
+        self._order = np.argsort(assignments, kind='stable')
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=len(centroids)))])
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def _assign(self, rows):
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.argmax(rows @ self.centroids.T, axis=1)
+
+    def _assign_all(self, chunk_rows=8192):
+        """Centroid of every row, upcasting quantized rows one chunk at a time."""
+        blocks = []
+        for start in range(0, len(self.embeddings), chunk_rows):
+            stop = start + chunk_rows
+            scales = self.scales[start:stop] if self.scales is not None else None
+            blocks.append(self._assign(dequantize(self.embeddings[start:stop], scales)))
+        return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.int64)
+
+    def updated(self, embeddings, keep, n_new):
+        if len(embeddings) == 0:
+            return BruteForceIndex(embeddings)
+        if len(embeddings) > self.retrain_factor * self.trained_size:
+            return IVFIndex(embeddings, nlist=int(np.sqrt(len(embeddings))), nprobe=self.nprobe,
+                            retrain_factor=self.retrain_factor)
+        new_rows = embeddings[len(embeddings) - n_new:] if n_new else embeddings[:0]
+        assignments = np.concatenate([self.assignments[keep], self._assign(new_rows)])
+        return IVFIndex(embeddings, nprobe=self.nprobe, centroids=self.centroids, assignments=assignments,
+                        trained_size=self.trained_size, retrain_factor=self.retrain_factor)
+
+    def rebuilt(self, embeddings, scales=None):
+        """Index over a new set of rows, reusing the trained centroids while they still fit."""
+        if len(embeddings) == 0:
+            return BruteForceIndex(embeddings, scales)
+        if len(embeddings) > self.retrain_factor * self.trained_size:
+            return IVFIndex(embeddings, nprobe=self.nprobe, retrain_factor=self.retrain_factor, scales=scales)
+        return IVFIndex(embeddings, nprobe=self.nprobe, centroids=self.centroids,
+                        trained_size=self.trained_size, retrain_factor=self.retrain_factor, scales=scales)
+
+    def search(self, query, k=1):
+        if len(self.embeddings) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        nprobe = min(self.nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        candidates = np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in lists])
+        if len(candidates) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scales = self.scales[candidates] if self.scales is not None else None
+        distances = 1.0 - cosine_scores(self.embeddings[candidates], query, scales)
+        k = min(k, len(candidates))
+        top = np.argsort(distances)[:k]
+        return candidates[top], distances[top]
+
+
+def make_index(embeddings, backend='exact', ivf_min_size=2000, scales=None, **kwargs):
+    """
+    Index factory: exact brute force by default; 'ivf' only once the
+    gallery is large enough for approximate search to pay off.
+    """
+    if backend == 'ivf' and len(embeddings) >= ivf_min_size:
+        return IVFIndex(embeddings, scales=scales, **kwargs)
+    if backend not in ('exact', 'ivf'):
+        raise ValueError(f"Unknown search backend: {backend}")
+    return BruteForceIndex(embeddings, scales)
+
+
+def recall_at_1(index, queries):
+    """Fraction of queries whose top-1 row matches exact brute-force search."""
+    exact = BruteForceIndex(index.embeddings, index.scales)
+    hits = 0
+    for query in queries:
+        expected, _ = exact.search(query, 1)
+        found, _ = index.search(query, 1)
+        hits += int(len(found) > 0 and found[0] == expected[0])
+    return hits / len(queries) if len(queries) else 1.0
+
+
+def sample_queries(embeddings, n=200, noise=0.05, seed=0):
+    """Noisy copies of random gallery rows, a stand-in for real probe images."""
+    rng = np.random.default_rng(seed)
+    rows = np.asarray(embeddings[rng.choice(len(embeddings), min(n, len(embeddings)), replace=False)], dtype=np.float32)
+    queries = rows + rng.normal(0, noise, rows.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    import json
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    rng = np.random.default_rng(0)
+    gallery = rng.normal(size=(size, 512)).astype(np.float32)
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+    queries = sample_queries(gallery, n=200, noise=0.03)
+
+    def timed(index):
+        started = time.perf_counter()
+        for query in queries:
+            index.search(query, 1)
+        return 1000 * (time.perf_counter() - started) / len(queries)
+
+    exact_ms = timed(BruteForceIndex(gallery))
+    print(json.dumps({"backend": "exact", "size": size, "ms_per_query": round(exact_ms, 3), "recall@1": 1.0}))
+    index = IVFIndex(gallery)
+    for nprobe in (1, 4, 8, 16, 32):
+        index.nprobe = nprobe
+        print(json.dumps({"backend": "ivf", "size": size, "nlist": len(index.centroids), "nprobe": nprobe,
+                          "ms_per_query": round(timed(index), 3), "recall@1": recall_at_1(index, queries)}))
@@ -0,0 +1,212 @@
+import os
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger("SharedGallery")
+
+
+class SharedGallery:
+    """
+    Keeps the gallery of several worker processes (gunicorn) in step through
+    files in one shared directory:
+
+    - `gallery.version`: a counter bumped after every write of the gallery
+      file. Workers poll it and reload the (memory-mapped, read-only) file
+      when it moves, instead of syncing and embedding on their own.
+    - `gallery.lock`: held (flock) around every change, so writes from
+      different workers never interleave. The holder first catches up with
+      the newest file, so a change is always applied on top of the others.
+    - `leader.lock`: held for life by one worker, which alone runs the cloud
+      sync. If it dies the lock is released and another worker takes over.
+    - `gallery.synced`: when the leader last confirmed the gallery matches
+      the bucket, so every worker can report staleness.
+
+    `reload_fn` loads the gallery file into this process. With a single
+    process the same code path simply makes it the leader.
+    """
+
+    def __init__(self, directory, reload_fn, poll_interval=1.0, on_leader=None):
+        self.directory = directory
+        self.version_path = os.path.join(directory, 'gallery.version')
+        self.lock_path = os.path.join(directory, 'gallery.lock')
+        self.leader_path = os.path.join(directory, 'leader.lock')
+        self.synced_path = os.path.join(directory, 'gallery.synced')
+        self.reload_fn = reload_fn
+        self.poll_interval = poll_interval
+        self.on_leader = on_leader
+        self.loaded_version = None
+        self.is_leader = False
+        self.reloads = 0
+        self.last_error = None
+        self._leader_fd = None
+        # flock is per open file: threads of one process also need a lock
+        self._local_lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def read_version(self):
+        """The published counter, or None if nothing was published yet."""
+        try:
+            with open(self.version_path) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, path, value):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(str(value))
+        os.replace(tmp_path, path)
+
+    def record_sync(self, timestamp):
+        """Called by the leader's syncer after every confirmed sync."""
+        self._write(self.synced_path, repr(timestamp))
+
+    def last_synced_at(self):
+        try:
+            with open(self.synced_path) as f:
+                return float(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def staleness(self):
+        """Seconds since the leader last confirmed the gallery in sync with the bucket (None if never)."""
+        synced_at = self.last_synced_at()
+        return None if synced_at is None else time.time() - synced_at
+
+    def try_acquire_leadership(self):
+        """Non-blocking: True if this process is (now) the leader."""
+        if self.is_leader:
+            return True
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(self.leader_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._leader_fd = fd
+        self.is_leader = True
+        logger.info(f">>> Worker {os.getpid()} is the gallery leader.")
+        return True
+
+    def take_leadership(self):
+        """
+        try_acquire_leadership() and run on_leader. If on_leader fails the
+        lock is given up again (and the error raised), so the watcher of this
+        or another worker retries instead of a leader that never syncs.
+        """
+        if self.is_leader or not self.try_acquire_leadership():
+            return False
+        try:
+            if self.on_leader:
+                self.on_leader()
+        except Exception:
+            self.release_leadership()
+            raise
+        return True
+
+    def release_leadership(self):
+        if self._leader_fd is not None:
+            os.close(self._leader_fd)
+            self._leader_fd = None
+        self.is_leader = False
+
+    def catch_up(self):
+        """Reload the gallery file if another process published a newer version. Returns True if it did."""
+        with self._local_lock:
+            version = self.read_version()
+            if version is None or version == self.loaded_version:
+                return False
+            self.reload_fn()
+            self.loaded_version = version
+            self.reloads += 1
+            logger.debug(f">>> Worker {os.getpid()} reloaded gallery v{version}.")
+            return True
+
+    def _try_catch_up(self):
+        """catch_up(), logging instead of raising (e.g. a file built for another model is rejected)."""
+        try:
+            return self.catch_up()
+        except Exception as e:
+            self.last_error = str(e)
+            logger.warning(f"⚠️ Could not load the shared gallery file: {e}")
+            return False
+
+    @contextmanager
+    def write_lock(self):
+        """
+        Exclusive across processes; the gallery is up to date on entry
+        (unless the shared file cannot be loaded, in which case the change
+        is applied to this process's gallery and replaces that file).
+        """
+        with self._local_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                self._try_catch_up()
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    def next_version(self):
+        """The version the next publish() will announce (call inside write_lock)."""
+        return (self.read_version() or 0) + 1
+
+    def publish(self, version=None):
+        """Bump the counter after rewriting the gallery file (call inside write_lock)."""
+        version = version if version is not None else self.next_version()
+        self._write(self.version_path, version)
+        self.loaded_version = version
+        return version
+
+    def _loop(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.take_leadership()
+                self.catch_up()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"❌ Shared gallery reload failed: {e}")
+
+    def wait_for_version(self, timeout=None):
+        """Block until a gallery was published and loaded here. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._stop.is_set():
+            self._try_catch_up()
+            if self.loaded_version is not None:
+                return True
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            self._stop.wait(self.poll_interval)
+        return False
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="gallery-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.release_leadership()
+
+    def stats(self):
+        return {
+            "pid": os.getpid(),
+            "leader": self.is_leader,
+            "version": self.loaded_version,
+            "reloads": self.reloads,
+            "last_error": self.last_error
+        }
@@ -0,0 +1,87 @@
+import io
+import json
+import os
+import zipfile
+import numpy as np
+import cv2
+import pytest
+from bulk_enroll import BulkEnrollment, iter_archive, iter_uploads
+from embedding_cache import EmbeddingCache
+
+
+def _jpeg(value):
+    img = np.full((8, 8, 3), value, dtype=np.uint8)
+    return cv2.imencode('.jpg', img)[1].tobytes()
+
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def _names(items):
+    return {source: name for source, name, _ in items}
+
+
+def test_one_folder_per_person():
+    archive = _zip({'Jane Doe/1.jpg': _jpeg(1), 'Jane Doe/2.PNG': _jpeg(2), 'loose.jpg': _jpeg(3),
+                    'Jane Doe/notes.txt': b'x', '__MACOSX/Jane Doe/._1.jpg': b'x', 'John Roe/': b''})
+    items = list(iter_archive(archive))
+    assert _names(items) == {'Jane Doe/1.jpg': 'Jane Doe', 'Jane Doe/2.PNG': 'Jane Doe', 'loose.jpg': None}
+    assert items[0][2] == _jpeg(1)
+
+
+def test_manifests_override_folders():
+    archive = _zip({'manifest.json': json.dumps({'a/1.jpg': 'From Archive', '2.jpg': 'By Basename',
+                                                 '3.jpg': 'Archive Loses'}),
+                    'a/1.jpg': _jpeg(1), 'b/2.jpg': _jpeg(2), '3.jpg': _jpeg(3)})
+    names = _names(iter_archive(archive, {'3.jpg': 'Request Wins'}))
+    assert names == {'a/1.jpg': 'From Archive', 'b/2.jpg': 'By Basename', '3.jpg': 'Request Wins'}
+
+
+def test_multipart_uploads_are_named_by_the_manifest():
+    items = list(iter_uploads([('1.jpg', io.BytesIO(b'one')), ('2.jpg', io.BytesIO(b'two'))], {'1.jpg': 'Jane'}))
+    assert items == [('1.jpg', 'Jane', b'one'), ('2.jpg', None, b'two')]
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    uploaded = []
+    return BulkEnrollment(
+        str(tmp_path / 'db' / 'objects'),
+        detect_fn=lambda img: [(np.full((1, 2, 2, 3), img.mean(), dtype=np.float32), {}, 0.99)] if img.mean() > 0 else [],
+        embed_fn=lambda crops: np.vstack([crop.reshape(1, -1) for crop in crops]),
+        cache=EmbeddingCache(str(tmp_path / 'embeddings.npz')),
+        upload_fn=lambda obj, path: uploaded.append((obj, path)),
+        batch_size=2,
+    ), uploaded
+
+
+def test_path_traversal_names_never_leave_the_object_store(pipeline, tmp_path):
+    pipeline, uploaded = pipeline
+    archive = _zip({'../../Jane Doe/evil.jpg': _jpeg(50), '../evil.jpg': _jpeg(60), '/abs/Max Poe/x.jpg': _jpeg(70)})
+    results = pipeline.run(iter_archive(archive))
+
+    by_source = {r["source"]: r for r in results}
+    assert by_source['../../Jane Doe/evil.jpg']["name"] == 'Jane Doe'
+    assert by_source['../evil.jpg']["status"] == 'failed'  # the '..' folder is not a name
+    stored = sorted(os.listdir(tmp_path / 'db' / 'objects'))
+    assert stored == sorted(r["object"] for r in results if r["status"] == 'enrolled')
+    assert all(len(os.path.splitext(obj)[0]) == 32 for obj in stored)  # '<md5>.jpg', never the member path
+    assert os.listdir(tmp_path) == ['db']  # nothing written next to the store
+    assert len(uploaded) == 2
+
+
+def test_results_keep_input_order_and_report_each_failure(pipeline):
+    pipeline, _ = pipeline
+    items = [('1.jpg', 'Jane Doe', _jpeg(10)), ('2.jpg', None, _jpeg(20)), ('3.jpg', 'John Roe', _jpeg(0)),
+             ('4.jpg', 'John Roe', OSError("truncated")), ('5.jpg', 'Jane Doe', _jpeg(10))]
+    results = pipeline.run(iter(items))
+    assert [r["source"] for r in results] == ['1.jpg', '2.jpg', '3.jpg', '4.jpg', '5.jpg']
+    assert [r["status"] for r in results] == ['enrolled', 'failed', 'failed', 'failed', 'enrolled']
+    assert 'No name' in results[1]["error"] and 'No face' in results[2]["error"] and 'truncated' in results[3]["error"]
+    assert results[0]["object"] == results[4]["object"]  # same bytes: one object, embedded once
@@ -0,0 +1,66 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from embedding_batcher import EmbeddingBatcher
+
+
+def _crop(value):
+    return np.full((1, 2, 2, 3), value, dtype=np.float32)
+
+
+class Model:
+    """Embeds a crop as [its value, batch size]; crops of value < 0 make the whole batch fail."""
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.lock = threading.Lock()
+
+    def __call__(self, batch):
+        with self.lock:
+            self.batch_sizes.append(len(batch))
+        if (batch < 0).any():
+            raise RuntimeError("bad batch")
+        values = batch.reshape(len(batch), -1)[:, 0]
+        return np.stack([values, np.full(len(batch), len(batch))], axis=1)
+
+
+def test_each_caller_gets_its_own_rows_in_order():
+    model = Model()
+    batcher = EmbeddingBatcher(model, max_batch_size=8, max_wait_ms=20)
+    requests = [[_crop(10 * i + j) for j in range(1 + i % 3)] for i in range(40)]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(batcher.embed, requests))
+    for i, result in enumerate(results):
+        assert list(result[:, 0]) == [10 * i + j for j in range(1 + i % 3)]
+    assert batcher.items == sum(len(r) for r in requests)
+    assert max(model.batch_sizes) > 1  # concurrent callers shared forward passes
+    assert batcher.batches == len(model.batch_sizes) < len(requests)
+
+
+def test_batch_size_is_capped_by_whole_jobs():
+    model = Model()
+    batcher = EmbeddingBatcher(model, max_batch_size=4, max_wait_ms=20)
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        list(pool.map(lambda i: batcher.embed([_crop(i)]), range(24)))
+    assert max(model.batch_sizes) <= 4
+
+
+def test_a_failed_batch_fails_every_caller_in_it_and_only_them():
+    model = Model()
+    # Waits long enough for all three jobs to land in one batch of exactly 3 crops
+    batcher = EmbeddingBatcher(model, max_batch_size=3, max_wait_ms=2000)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(batcher.embed, [_crop(value)]) for value in (1, -1, 2)]
+    assert model.batch_sizes == [3]
+    assert all(isinstance(f.exception(), RuntimeError) for f in futures)
+    # The worker survives: the next batch is unaffected
+    batcher.max_wait = 0
+    assert batcher.embed([_crop(5)])[0, 0] == 5
+
+
+def test_single_job_error_is_raised_to_the_caller():
+    batcher = EmbeddingBatcher(Model(), max_batch_size=1, max_wait_ms=0)
+    with pytest.raises(RuntimeError):
+        batcher.embed([_crop(-1)])
+    assert batcher.embed([]).shape == (0, 0)
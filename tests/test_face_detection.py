@@ -0,0 +1,101 @@
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from face_detection import CascadeDetector, DeepFaceDetector, default_min_confidence, make_detector
+
+
+class SharedNet:
+    """Like DeepFace's cached cv2.dnn_Net: setInput() then forward() on one object."""
+
+    def __init__(self):
+        self.input = None
+
+    def extract_faces(self, img, target_size, detector_backend, grayscale, enforce_detection, align):
+        self.input = img
+        time.sleep(0.001)
+        if img.mean() == 0:
+            raise ValueError("Face could not be detected. Please confirm that the picture is a face photo.")
+        return [(self.input, {"x": 0, "y": 0, "w": 1, "h": 1}, 0.99)]
+
+
+@pytest.fixture
+def shared_net(monkeypatch):
+    net = SharedNet()
+    functions = types.ModuleType('deepface.commons.functions')
+    functions.extract_faces = net.extract_faces
+    commons = types.ModuleType('deepface.commons')
+    commons.functions = functions
+    monkeypatch.setitem(sys.modules, 'deepface', types.ModuleType('deepface'))
+    monkeypatch.setitem(sys.modules, 'deepface.commons', commons)
+    monkeypatch.setitem(sys.modules, 'deepface.commons.functions', functions)
+    return net
+
+
+def test_concurrent_detections_get_their_own_faces(shared_net):
+    # Separate instances still share the backend, like the request pool and the bulk pool do
+    detectors = [DeepFaceDetector('ssd') for _ in range(2)]
+    images = [np.full((4, 4, 3), i, dtype=np.uint8) for i in range(1, 65)]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda i: detectors[i % 2].detect(images[i]), range(len(images))))
+    for img, faces in zip(images, results):
+        assert faces[0][0] is img
+
+
+def test_no_face_is_an_empty_list(shared_net):
+    assert DeepFaceDetector('ssd').detect(np.zeros((4, 4, 3), dtype=np.uint8)) == []
+
+
+class StubDetector:
+    """Answers from a table {image key: best score}; a missing key means no face."""
+
+    def __init__(self, name, scores):
+        self.name = name
+        self.scores = scores
+        self.calls = []
+
+    def warm(self):
+        pass
+
+    def detect(self, img):
+        self.calls.append(img)
+        score = self.scores.get(img)
+        return [] if score is None else [(self.name, {}, score)]
+
+
+def test_cascade_accepts_escalates_and_short_circuits():
+    fast = StubDetector('opencv', {'clear': 6.0, 'blurry': 2.0})
+    slow = StubDetector('ssd', {'clear': 0.99, 'blurry': 0.95, 'profile': 0.9})
+    cascade = CascadeDetector(fast, slow, min_confidence=4.0, escalate_empty=True)
+
+    assert cascade.detect('clear')[0][0] == 'opencv'  # confident: the slow stage is never run
+    assert cascade.detect('blurry')[0][0] == 'ssd'  # low score: escalated
+    assert cascade.detect('profile')[0][0] == 'ssd'  # fast stage found nothing: escalated
+    assert slow.calls == ['blurry', 'profile']
+
+    cascade.escalate_empty = False
+    assert cascade.detect('profile') == []
+    assert slow.calls == ['blurry', 'profile']
+    stats = cascade.stats()
+    assert (stats["fast_accepted"], stats["escalated"], stats["short_circuited"]) == (1, 2, 1)
+    assert stats["escalation_rate"] == 0.5 and stats["detector"] == 'opencv>ssd'
+
+
+def test_cascade_counts_stay_exact_under_concurrency():
+    fast = StubDetector('mediapipe', {i: 0.95 if i % 2 else 0.5 for i in range(200)})
+    slow = StubDetector('ssd', {i: 0.99 for i in range(200)})
+    cascade = CascadeDetector(fast, slow, min_confidence=0.9)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(cascade.detect, range(200)))
+    assert (cascade.fast_accepted, cascade.escalated) == (100, 100)
+
+
+def test_make_detector_uses_the_fast_backends_own_threshold():
+    assert isinstance(make_detector('ssd'), DeepFaceDetector)
+    assert isinstance(make_detector('ssd', fast_backend='ssd'), DeepFaceDetector)
+    haar = make_detector('ssd', fast_backend='opencv')
+    assert haar.min_confidence == default_min_confidence('opencv') > 1  # Haar scores are not probabilities
+    assert make_detector('ssd', fast_backend='mediapipe').min_confidence == 0.9
+    assert make_detector('ssd', fast_backend='opencv', min_confidence=2.5).min_confidence == 2.5
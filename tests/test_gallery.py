@@ -0,0 +1,180 @@
+import numpy as np
+import pytest
+from embedding_cache import EmbeddingCache
+from gallery import FaceGallery, l2_normalize
+from quantization import quantize
+
+DIM = 32
+PEOPLE = ['Jane Doe', 'John Roe', 'Max Poe']
+
+
+def _face(person, seed):
+    """An image of one person: their own direction plus a little noise."""
+    centre = np.eye(DIM, dtype=np.float32)[PEOPLE.index(person)]
+    return l2_normalize(centre + 0.15 * np.random.default_rng(seed).standard_normal(DIM))
+
+
+class Embedder:
+    """Stands in for embed_image: looks the 'image path' (the label) up and counts calls."""
+
+    def __init__(self):
+        self.vectors = {}
+        self.calls = []
+
+    def enroll(self, person, seed):
+        label = f"{person}_h{seed}.jpg"
+        self.vectors[label] = _face(person, seed)
+        return label, f"h{seed}"
+
+    def __call__(self, path):
+        self.calls.append(path)
+        if path not in self.vectors:
+            raise ValueError("No face detected.")
+        return self.vectors[path]
+
+
+@pytest.fixture
+def embedder():
+    return Embedder()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(str(tmp_path / 'embeddings.npz'))
+
+
+def _sync(gallery, entries, embedder, cache):
+    return gallery.sync_entries(entries, None, embedder, cache, path_fn=lambda label: label)
+
+
+def _entries(embedder, per_person=3):
+    return dict(embedder.enroll(person, 10 * i + j) for i, person in enumerate(PEOPLE) for j in range(per_person))
+
+
+def test_sync_embeds_only_new_content(embedder, cache):
+    gallery = FaceGallery()
+    entries = _entries(embedder)
+    assert _sync(gallery, entries, embedder, cache)
+    assert len(gallery) == 9 and gallery.identity_count == 3 and len(embedder.calls) == 9
+    assert not _sync(gallery, entries, embedder, cache)  # nothing changed
+    assert gallery.version == 1
+
+    # Renamed image: same content hash, its row is reused
+    label, content_hash = next(iter(entries.items()))
+    renamed = {**{l: h for l, h in entries.items() if l != label}, f"Jane Doe_renamed.jpg": content_hash}
+    assert _sync(gallery, renamed, embedder, cache)
+    assert len(embedder.calls) == 9
+    assert 'Jane Doe_renamed.jpg' in set(gallery.labels)
+
+
+def test_removed_and_re_added_images(embedder, cache):
+    gallery = FaceGallery()
+    entries = _entries(embedder)
+    _sync(gallery, entries, embedder, cache)
+    removed = [l for l in entries if l.startswith('Max Poe')]
+    assert _sync(gallery, {l: h for l, h in entries.items() if l not in removed}, embedder, cache)
+    assert len(gallery) == 6 and gallery.identity_count == 2
+    assert not any(gallery.has_hash(entries[l]) for l in removed)
+    assert len(cache) == 6  # a full sync prunes the cache to the enrolled hashes
+
+    # Re-enrolled through the enrollment path: embedded once, then found by hash
+    calls = len(embedder.calls)
+    assert gallery.update_entries({l: entries[l] for l in removed}, None, embedder, cache, path_fn=lambda l: l)
+    assert len(gallery) == 9 and len(embedder.calls) == calls + 3
+    assert not gallery.update_entries({removed[0]: entries[removed[0]]}, None, embedder, cache, path_fn=lambda l: l)
+
+
+def test_changed_content_is_re_embedded(embedder, cache):
+    gallery = FaceGallery()
+    entries = _entries(embedder)
+    _sync(gallery, entries, embedder, cache)
+    label = next(iter(entries))
+    embedder.vectors[label] = _face('Jane Doe', 99)
+    assert _sync(gallery, {**entries, label: 'h99'}, embedder, cache)
+    assert embedder.calls[-1] == label
+    assert gallery.has_hash('h99') and not gallery.has_hash(entries[label])
+
+
+def test_images_without_a_face_are_skipped(embedder, cache):
+    gallery = FaceGallery()
+    entries = {**_entries(embedder), 'Nobody_hx.jpg': 'hx'}
+    assert _sync(gallery, entries, embedder, cache)
+    assert len(gallery) == 9 and not gallery.has_hash('hx')
+
+
+def test_update_entries_keeps_embeddings_of_pending_changes(embedder, cache):
+    gallery = FaceGallery()
+    entries = _entries(embedder)
+    _sync(gallery, entries, embedder, cache)
+    cache.put('pending', _face('Jane Doe', 50))  # e.g. embedded ahead of a sync that is still downloading
+    label, content_hash = embedder.enroll('John Roe', 60)
+    gallery.update_entries({label: content_hash}, None, embedder, cache, path_fn=lambda l: l)
+    assert 'pending' in cache
+
+
+@pytest.mark.parametrize("mode", ['mean', 'kmedoids', 'image'])
+def test_prototypes(embedder, cache, mode):
+    gallery = FaceGallery(prototype_mode=mode, medoids_per_identity=2)
+    _sync(gallery, _entries(embedder, per_person=4), embedder, cache)
+    snapshot = gallery.snapshot
+    rows = snapshot.rows_float32()
+    if mode == 'mean':
+        assert len(snapshot.prototypes) == 3
+        for identity in range(3):
+            expected = l2_normalize(rows[snapshot.identity_rows(identity)].sum(axis=0))
+            assert np.allclose(snapshot.prototypes[identity], expected, atol=1e-5)
+    elif mode == 'kmedoids':
+        assert len(snapshot.prototypes) == 6
+        for prototype, identity in zip(snapshot.prototypes, snapshot.prototype_identity):
+            own = rows[snapshot.identity_rows(identity)]
+            assert np.isclose(own @ prototype, 1.0, atol=1e-5).any()  # a medoid is one of the person's images
+    else:
+        assert len(snapshot.prototypes) == 12
+        assert np.array_equal(snapshot.prototype_identity, snapshot.row_identity)
+
+
+@pytest.mark.parametrize("mode", ['mean', 'kmedoids', 'image'])
+def test_match_many_against_the_threshold(embedder, cache, mode):
+    gallery = FaceGallery(threshold=0.68, prototype_mode=mode)
+    _sync(gallery, _entries(embedder), embedder, cache)
+    stranger = np.eye(DIM, dtype=np.float32)[DIM - 1]
+    matches = gallery.match_many(np.vstack([_face('John Roe', 500), _face('Max Poe', 501), stranger]))
+    assert [m[0] if m else None for m in matches] == ['John Roe', 'Max Poe', None]
+    name, label, distance = matches[0]
+    assert label.startswith('John Roe_') and 0 <= distance <= 0.68
+
+
+def test_match_many_on_an_empty_gallery():
+    assert FaceGallery().match_many(np.ones((2, DIM), dtype=np.float32)) == [None, None]
+
+
+def test_verify_many_checks_the_claimed_identity(embedder, cache):
+    gallery = FaceGallery()
+    _sync(gallery, _entries(embedder), embedder, cache)
+    probe = _face('Jane Doe', 700)
+    results = gallery.verify_many(np.vstack([probe, probe, probe]), ['Jane Doe', 'John Roe', 'Someone Else'])
+    assert results[0][0] == 'Jane Doe'
+    assert results[1] is None  # a wrong claim is rejected by the threshold
+    assert results[2] is None
+
+
+def test_searches_pin_the_snapshot_they_were_given(embedder, cache):
+    gallery = FaceGallery()
+    _sync(gallery, _entries(embedder), embedder, cache)
+    before = gallery.snapshot
+    _sync(gallery, {}, embedder, cache)
+    assert gallery.match_many(_face('Jane Doe', 800)[None]) == [None]
+    assert gallery.match_many(_face('Jane Doe', 800)[None], before)[0][0] == 'Jane Doe'
+
+
+def test_quantized_storage_matches_like_float32(embedder, cache):
+    gallery = FaceGallery()
+    _sync(gallery, _entries(embedder), embedder, cache)
+    probes = np.vstack([_face(person, 900 + i) for i, person in enumerate(PEOPLE)])
+    expected = [m[:2] for m in gallery.match_many(probes)]
+    snapshot = gallery.snapshot
+    data, scales = quantize(snapshot.rows_float32(), 'int8')
+    assert gallery.swap_storage(snapshot.version, data, scales, new_version=7)
+    assert gallery.version == 7 and gallery.snapshot.embeddings.dtype == np.int8
+    assert [m[:2] for m in gallery.match_many(probes)] == expected
+    assert not gallery.swap_storage(snapshot.version, data, scales)  # the gallery moved on
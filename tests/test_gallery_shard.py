@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from gallery import l2_normalize
+from gallery_shard import read_shard, write_shard
+from quantization import dequantize, quantization_report, quantize
+
+
+def _rows(n, dim=16, seed=0):
+    return l2_normalize(np.random.default_rng(seed).standard_normal((n, dim)))
+
+
+def _write(path, n, seed=0, dtype='float16'):
+    write_shard(path, _rows(n, seed=seed), [f"p{i}_{i}.jpg" for i in range(n)], [f"h{i}" for i in range(n)],
+                fingerprint='fp', version=seed, dtype=dtype)
+
+
+def test_mapped_rows_survive_replacement_of_the_file(tmp_path):
+    path = str(tmp_path / 'gallery.bsg')
+    _write(path, 5, seed=1)
+    header, embeddings, _ = read_shard(path)
+    _write(path, 9, seed=2)  # another worker commits a new version
+    assert header["count"] == len(embeddings) == 5
+    assert np.allclose(np.linalg.norm(embeddings.astype(np.float32), axis=1), 1.0, atol=1e-2)
+    assert read_shard(path)[0]["count"] == 9
+
+
+def test_rejects_header_that_does_not_match_file_size(tmp_path):
+    path = str(tmp_path / 'gallery.bsg')
+    _write(path, 5)
+    with open(path, 'ab') as f:
+        f.write(b'\0' * 8)
+    with pytest.raises(ValueError):
+        read_shard(path)
+
+
+@pytest.mark.parametrize("dtype, atol", [('float32', 0), ('float16', 1e-3), ('int8', 1e-2)])
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip(tmp_path, dtype, atol, mmap):
+    path = str(tmp_path / 'gallery.bsg')
+    rows = _rows(7, dim=33)  # odd sizes exercise the alignment padding
+    labels, hashes = [f"p{i}_{i}.jpg" for i in range(7)], [f"h{i}" for i in range(7)]
+    write_shard(path, rows, labels, hashes, fingerprint='fp', version=3, dtype=dtype, model_name='ArcFace',
+                extra={"built_by": "test"})
+
+    header, embeddings, scales = read_shard(path, mmap=mmap)
+    assert (header["labels"], header["hashes"]) == (labels, hashes)
+    assert (header["fingerprint"], header["version"], header["model_name"]) == ('fp', 3, 'ArcFace')
+    assert header["built_by"] == "test"
+    assert embeddings.dtype == np.dtype(dtype) and embeddings.shape == (7, 33)
+    assert (scales is not None) == (dtype == 'int8')
+    assert np.allclose(dequantize(embeddings, scales), rows, atol=atol)
+
+
+def test_quantized_rows_are_rewritten_without_compounding_error(tmp_path):
+    path = str(tmp_path / 'gallery.bsg')
+    rows = _rows(6)
+    data, scales = quantize(rows, 'int8')
+    # e.g. the int8 rows of a loaded snapshot written back out as float16
+    write_shard(path, data, [str(i) for i in range(6)], [str(i) for i in range(6)],
+                fingerprint='fp', version=1, dtype='float16', scales=scales)
+    _, embeddings, _ = read_shard(path)
+    assert np.allclose(embeddings.astype(np.float32), dequantize(data, scales), atol=1e-3)
+
+
+def test_empty_gallery_round_trip(tmp_path):
+    path = str(tmp_path / 'gallery.bsg')
+    write_shard(path, np.zeros((0, 16), dtype=np.float32), [], [], fingerprint='fp', version=0)
+    header, embeddings, scales = read_shard(path)
+    assert header["count"] == 0 and len(embeddings) == 0 and scales is None
+
+
+def test_quantization_report_measures_small_error():
+    rows = _rows(500, dim=64)
+    assert quantization_report(rows, 'float32')["max_abs_error"] == 0.0
+    report = quantization_report(rows, 'int8')
+    assert report["max_abs_error"] < 0.02 and report["top1_agreement"] >= 0.99
+
+
+def test_rejects_unknown_dtype(tmp_path):
+    with pytest.raises(ValueError):
+        write_shard(str(tmp_path / 'gallery.bsg'), _rows(2), ['a', 'b'], ['a', 'b'],
+                    fingerprint='fp', version=0, dtype='bfloat16')
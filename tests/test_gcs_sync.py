@@ -0,0 +1,149 @@
+import hashlib
+import os
+import time
+import pytest
+from content_store import MANIFEST_FILENAME, OBJECTS_DIR, Manifest, object_label, object_name
+from gcs_sync import (GallerySyncer, LocalBucket, PreconditionFailed, import_legacy_blobs, manifest_fingerprint,
+                      read_manifest, sync_manifest, update_manifest)
+
+PREFIX = 'faces/'
+MANIFEST_BLOB = f"{PREFIX}{MANIFEST_FILENAME}"
+
+
+def _enroll(bucket, name, contents):
+    """Upload an object and name it in the bucket manifest, as /enroll does."""
+    obj = object_name(hashlib.md5(contents).hexdigest(), 'photo.jpg')
+    bucket.blob(f"{PREFIX}{OBJECTS_DIR}/{obj}").upload_from_string(contents)
+    update_manifest(bucket, MANIFEST_BLOB, lambda manifest: manifest.add(name, obj))
+    return obj
+
+
+def _remove(bucket, name):
+    update_manifest(bucket, MANIFEST_BLOB, lambda manifest: manifest.names.pop(name, None) is not None)
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    return LocalBucket(str(tmp_path / 'bucket'))
+
+
+def test_sync_downloads_new_objects_and_removes_dropped_ones(bucket, tmp_path):
+    dest = str(tmp_path / 'local')
+    jane = _enroll(bucket, 'Jane Doe', b'jane')
+    john = _enroll(bucket, 'John Roe', b'john')
+
+    result = sync_manifest(bucket, PREFIX, dest)
+    assert sorted(result.downloaded) == sorted([jane, john]) and not result.failed
+    assert result.remote == {object_label('Jane Doe', jane): os.path.splitext(jane)[0],
+                             object_label('John Roe', john): os.path.splitext(john)[0]}
+    with open(os.path.join(dest, OBJECTS_DIR, jane), 'rb') as f:
+        assert f.read() == b'jane'
+
+    _remove(bucket, 'John Roe')
+    result = sync_manifest(bucket, PREFIX, dest)
+    assert result.downloaded == [] and result.removed == [john]
+    assert not os.path.exists(os.path.join(dest, OBJECTS_DIR, john))
+    assert Manifest.load(os.path.join(dest, MANIFEST_FILENAME)).names == {'Jane Doe': [jane]}
+
+
+def test_sync_skips_objects_the_caller_does_not_need(bucket, tmp_path):
+    obj = _enroll(bucket, 'Jane Doe', b'jane')
+    result = sync_manifest(bucket, PREFIX, str(tmp_path / 'local'), need_fn=lambda obj, md5: False)
+    assert result.skipped == [obj] and result.downloaded == []
+    assert object_label('Jane Doe', obj) in result.remote
+
+
+def test_sync_reports_objects_that_could_not_be_downloaded(bucket, tmp_path):
+    obj = _enroll(bucket, 'Jane Doe', b'jane')
+    bucket.blob(f"{PREFIX}{OBJECTS_DIR}/{obj}").delete()
+    result = sync_manifest(bucket, PREFIX, str(tmp_path / 'local'))
+    assert result.failed == [obj]
+    assert not [name for name in os.listdir(tmp_path / 'local' / OBJECTS_DIR) if name.endswith('.part')]
+
+
+def test_manifest_update_is_retried_after_a_concurrent_write(bucket):
+    _enroll(bucket, 'Jane Doe', b'jane')
+    calls = []
+
+    def add_john(manifest):
+        if not calls:  # another worker enrolls someone between our read and our write
+            time.sleep(0.05)  # LocalBlob generations are mtimes: make sure this one moves
+            _enroll(bucket, 'Max Poe', b'max')
+        calls.append(1)
+        return manifest.add('John Roe', 'abc.jpg')
+
+    manifest, changed = update_manifest(bucket, MANIFEST_BLOB, add_john)
+    assert changed and len(calls) == 2
+    assert sorted(read_manifest(bucket, MANIFEST_BLOB)[0].names) == ['Jane Doe', 'John Roe', 'Max Poe']
+
+
+def test_stale_generation_is_rejected(bucket):
+    _enroll(bucket, 'Jane Doe', b'jane')
+    with pytest.raises(PreconditionFailed):
+        bucket.blob(MANIFEST_BLOB).upload_from_string(b'{}', if_generation_match=1)
+
+
+def test_legacy_flat_blobs_are_imported(bucket):
+    bucket.blob(f"{PREFIX}Jane_Doe_photo.jpg").upload_from_string(b'jane')
+    bucket.blob(f"{PREFIX}notes.txt").upload_from_string(b'not a face')
+    manifest = Manifest()
+    assert import_legacy_blobs(bucket, PREFIX, manifest, name_fn=lambda filename: 'Jane Doe') == 1
+    obj = object_name(hashlib.md5(b'jane').hexdigest(), 'photo.jpg')
+    assert manifest.names == {'Jane Doe': [obj]}
+    assert bucket.blob(f"{PREFIX}{OBJECTS_DIR}/{obj}").exists()
+
+
+def test_syncer_only_syncs_when_the_manifest_changes(bucket, tmp_path):
+    dest = str(tmp_path / 'local')
+    synced_at = []
+
+    def sync():
+        result = sync_manifest(bucket, PREFIX, dest)
+        if result.failed:
+            raise RuntimeError(f"{len(result.failed)} downloads failed")
+
+    syncer = GallerySyncer(sync, fingerprint_fn=lambda: manifest_fingerprint(bucket, MANIFEST_BLOB),
+                           on_synced=synced_at.append)
+    _enroll(bucket, 'Jane Doe', b'jane')
+    assert syncer.run_once() is True
+    assert syncer.run_once() is False  # unchanged: no sync, but still confirmed fresh
+    assert syncer.sync_count == 1 and len(synced_at) == 2
+    assert syncer.staleness() < 5
+
+    _enroll(bucket, 'John Roe', b'john')
+    assert syncer.run_once() is True
+    assert len(os.listdir(os.path.join(dest, OBJECTS_DIR))) == 2
+
+
+def test_syncer_retries_a_failed_sync(bucket, tmp_path):
+    dest = str(tmp_path / 'local')
+    obj = _enroll(bucket, 'Jane Doe', b'jane')
+    blob = bucket.blob(f"{PREFIX}{OBJECTS_DIR}/{obj}")
+    blob.delete()
+
+    def sync():
+        if sync_manifest(bucket, PREFIX, dest).failed:
+            raise RuntimeError("downloads failed")
+
+    syncer = GallerySyncer(sync, fingerprint_fn=lambda: manifest_fingerprint(bucket, MANIFEST_BLOB))
+    assert syncer.run_once() is False
+    assert syncer.last_error and syncer.last_synced_at is None
+    # Same manifest generation, but the failed sync was not recorded as done
+    blob.upload_from_string(b'jane')
+    assert syncer.run_once() is True
+    assert syncer.last_error is None
+    assert os.listdir(os.path.join(dest, OBJECTS_DIR)) == [obj]
+
+
+def test_file_upload_only_replaces_the_generation_it_expects(bucket, tmp_path):
+    shard = tmp_path / 'gallery.bsg'
+    shard.write_bytes(b'v1')
+    blob = bucket.blob('shards/gallery.bsg')
+    blob.upload_from_filename(str(shard), if_generation_match=0)
+    seen = blob.generation
+    time.sleep(0.05)  # LocalBlob generations are mtimes
+    bucket.blob('shards/gallery.bsg').upload_from_filename(str(shard))  # another instance
+    shard.write_bytes(b'v2')
+    with pytest.raises(PreconditionFailed):
+        blob.upload_from_filename(str(shard), if_generation_match=seen)
+    assert blob.download_as_bytes() == b'v1'
@@ -0,0 +1,43 @@
+import asyncio
+import time
+import pytest
+from inference_pool import InferencePool, PoolSaturated
+
+
+def test_runs_job_and_returns_result():
+    pool = InferencePool(max_workers=1, max_queue=0, timeout=5)
+    assert asyncio.run(pool.run(lambda a, b: a + b, 2, 3)) == 5
+    assert pool.pending == 0
+
+
+def test_rejects_when_saturated():
+    pool = InferencePool(max_workers=1, max_queue=1, timeout=5)
+
+    async def scenario():
+        jobs = [asyncio.ensure_future(pool.run(time.sleep, 0.2)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(PoolSaturated):
+            await pool.run(time.sleep, 0)
+        await asyncio.gather(*jobs)
+
+    asyncio.run(scenario())
+    assert pool.rejected == 1
+    assert pool.pending == 0
+
+
+def test_timed_out_jobs_give_their_slots_back():
+    pool = InferencePool(max_workers=1, max_queue=2, timeout=0.2)
+
+    async def scenario():
+        results = await asyncio.gather(*[pool.run(time.sleep, 0.5) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(r, asyncio.TimeoutError) for r in results)
+
+    asyncio.run(scenario())
+    time.sleep(0.6)  # the job that was running when it timed out finishes on its own
+    assert pool.timed_out == 3
+    assert pool.pending == 0
+    # Every slot is free again: a full pool's worth of jobs is accepted
+    async def refill():
+        return await asyncio.gather(*[pool.run(lambda: 1, timeout=5) for _ in range(3)])
+
+    assert asyncio.run(refill()) == [1, 1, 1]
@@ -0,0 +1,61 @@
+import time
+import numpy as np
+import cv2
+from result_cache import ResultCache, perceptual_hash
+
+
+def test_hits_and_misses():
+    cache = ResultCache(max_size=4, ttl=60)
+    assert cache.get('a', 1) is None
+    cache.put('a', 1, {"name": "Jane"})
+    assert cache.get('a', 1) == {"name": "Jane"}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_expire_after_ttl():
+    cache = ResultCache(max_size=4, ttl=0.05)
+    cache.put('a', 1, 'x')
+    time.sleep(0.1)
+    assert cache.get('a', 1) is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_size=2, ttl=60)
+    cache.put('a', 1, 'A')
+    cache.put('b', 1, 'B')
+    cache.get('a', 1)  # 'b' is now the oldest
+    cache.put('c', 1, 'C')
+    assert cache.get('b', 1) is None
+    assert (cache.get('a', 1), cache.get('c', 1)) == ('A', 'C')
+
+
+def test_newer_gallery_version_drops_everything():
+    cache = ResultCache(max_size=4, ttl=60)
+    cache.put('a', 1, 'A')
+    assert cache.get('a', 2) is None
+    assert len(cache) == 0 and cache.invalidations == 1
+
+
+def test_a_request_on_an_older_snapshot_does_not_clear_newer_entries():
+    cache = ResultCache(max_size=4, ttl=60)
+    cache.put('a', 2, 'A@2')
+    cache.put('b', 1, 'B@1')  # searched v1 while a sync published v2
+    assert cache.get('b', 1) is None
+    assert cache.get('a', 2) == 'A@2'
+    assert cache.invalidations == 0
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ResultCache(max_size=0)
+    cache.put('a', 1, 'A')
+    assert cache.get('a', 1) is None and len(cache) == 0
+
+
+def test_perceptual_hash_survives_re_encoding():
+    # One flat cell per hash pixel, with clearly different neighbours
+    cells = (np.random.default_rng(0).permutation(72).reshape(8, 9) * 3 + 20).astype(np.uint8)
+    img = cv2.cvtColor(cv2.resize(cells, (9 * 16, 8 * 16), interpolation=cv2.INTER_NEAREST), cv2.COLOR_GRAY2BGR)
+    _, jpeg = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    assert perceptual_hash(cv2.imdecode(jpeg, cv2.IMREAD_COLOR)) == perceptual_hash(img)
+    assert perceptual_hash(cv2.flip(img, 1)) != perceptual_hash(img)
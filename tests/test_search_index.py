@@ -0,0 +1,65 @@
+import numpy as np
+from gallery import l2_normalize
+from quantization import quantize
+from search_index import BruteForceIndex, IVFIndex, make_index, recall_at_1, sample_queries
+
+
+def _clustered(n, dim=64, clusters=40, seed=0):
+    """Rows around a few centres, like several photos per person."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim))
+    return l2_normalize(centres[rng.integers(clusters, size=n)] + 0.3 * rng.standard_normal((n, dim))).astype(np.float32)
+
+
+def test_ivf_recall_against_exact_search():
+    gallery = _clustered(3000)
+    index = IVFIndex(gallery, nprobe=8)
+    assert recall_at_1(index, sample_queries(gallery, n=200, noise=0.03)) >= 0.95
+
+
+def test_ivf_recall_on_int8_rows():
+    gallery = _clustered(3000)
+    data, scales = quantize(gallery, 'int8')
+    index = IVFIndex(data, nprobe=8, scales=scales)
+    assert recall_at_1(index, sample_queries(gallery, n=200, noise=0.03)) >= 0.95
+
+
+def test_incremental_update_matches_a_fresh_assignment():
+    gallery = _clustered(2000, seed=1)
+    index = IVFIndex(gallery)
+    keep = np.ones(len(gallery), dtype=bool)
+    keep[::7] = False
+    added = _clustered(300, seed=2)
+    merged = np.vstack([gallery[keep], added])
+
+    updated = index.updated(merged, keep, n_new=len(added))
+    assert updated.centroids is index.centroids  # no retraining for a small change
+    assert len(updated) == len(merged)
+    assert np.array_equal(updated.assignments, np.argmax(merged @ index.centroids.T, axis=1))
+    # An added row is found as its own nearest neighbour
+    rows, distances = updated.search(added[5], 1)
+    assert rows[0] == len(merged) - len(added) + 5
+    assert distances[0] < 1e-5
+
+
+def test_update_retrains_once_the_gallery_has_grown():
+    gallery = _clustered(500, seed=3)
+    index = IVFIndex(gallery, retrain_factor=2.0)
+    merged = np.vstack([gallery, _clustered(700, seed=4)])
+    updated = index.updated(merged, np.ones(len(gallery), dtype=bool), n_new=700)
+    assert updated.trained_size == len(merged)
+    assert updated.centroids is not index.centroids
+
+
+def test_update_to_empty_gallery_falls_back_to_exact():
+    index = IVFIndex(_clustered(100))
+    empty = np.zeros((0, 64), dtype=np.float32)
+    updated = index.updated(empty, np.zeros(100, dtype=bool), n_new=0)
+    assert isinstance(updated, BruteForceIndex)
+    assert len(updated.search(np.ones(64, dtype=np.float32))[0]) == 0
+
+
+def test_make_index_stays_exact_for_small_galleries():
+    gallery = _clustered(100)
+    assert isinstance(make_index(gallery, backend='ivf', ivf_min_size=2000), BruteForceIndex)
+    assert isinstance(make_index(gallery, backend='ivf', ivf_min_size=50), IVFIndex)
@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+import time
+import numpy as np
+import pytest
+from gallery import l2_normalize
+from gallery_shard import read_shard, write_shard
+from shared_gallery import SharedGallery
+
+# Workers are forked like gunicorn's; flock and the version file are what keep them in step
+fork = multiprocessing.get_context('fork')
+
+
+class Worker:
+    """One process's view of the gallery: the rows of the shard file it last loaded."""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, 'gallery.bsg')
+        self.labels = []
+        self.shared = SharedGallery(directory, reload_fn=self.reload, poll_interval=0.02)
+
+    def reload(self):
+        self.labels = read_shard(self.path)[0]["labels"]
+
+    def enroll(self, label):
+        with self.shared.write_lock():
+            labels = self.labels + [label]
+            rows = l2_normalize(np.random.default_rng(len(labels)).standard_normal((len(labels), 8)))
+            write_shard(self.path, rows, labels, labels, fingerprint='fp', version=len(labels), dtype='float16')
+            self.labels = labels
+            self.shared.publish()
+
+
+def _follow(directory, expected, queue):
+    worker = Worker(directory)
+    worker.shared.start()
+    deadline = time.monotonic() + 10
+    while len(worker.labels) < expected and time.monotonic() < deadline:
+        time.sleep(0.02)
+    queue.put((worker.labels, worker.shared.reloads, worker.shared.staleness()))
+    worker.shared.stop()
+
+
+def _enroll_many(directory, prefix, n):
+    worker = Worker(directory)
+    for i in range(n):
+        worker.enroll(f"{prefix}{i}")
+
+
+def _lead(directory, ready, release):
+    shared = SharedGallery(directory, reload_fn=lambda: None)
+    shared.try_acquire_leadership()
+    ready.set()
+    release.wait(10)
+
+
+def test_followers_reload_what_another_process_publishes(tmp_path):
+    directory = str(tmp_path)
+    leader = Worker(directory)
+    leader.enroll('a')
+    leader.shared.record_sync(time.time())
+    queue = fork.Queue()
+    follower = fork.Process(target=_follow, args=(directory, 3, queue))
+    follower.start()
+    leader.enroll('b')
+    leader.enroll('c')
+    labels, reloads, staleness = queue.get(timeout=15)
+    follower.join(5)
+    assert labels == ['a', 'b', 'c']
+    assert reloads >= 1
+    assert staleness is not None and staleness < 10  # the leader's sync time is visible to followers
+
+
+def test_concurrent_writers_never_lose_a_change(tmp_path):
+    directory = str(tmp_path)
+    writers = [fork.Process(target=_enroll_many, args=(directory, prefix, 10)) for prefix in 'xyz']
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join(30)
+        assert writer.exitcode == 0
+    worker = Worker(directory)
+    assert worker.shared.catch_up()
+    assert sorted(worker.labels) == sorted(f"{p}{i}" for p in 'xyz' for i in range(10))
+    assert worker.shared.read_version() == 30
+
+
+def test_leadership_moves_when_the_leader_exits(tmp_path):
+    directory = str(tmp_path)
+    ready, release = fork.Event(), fork.Event()
+    leader = fork.Process(target=_lead, args=(directory, ready, release))
+    leader.start()
+    assert ready.wait(10)
+    shared = SharedGallery(directory, reload_fn=lambda: None)
+    assert not shared.try_acquire_leadership()
+    release.set()
+    leader.join(10)
+    assert shared.try_acquire_leadership()
+    shared.stop()
+
+
+def test_failed_leader_start_gives_leadership_up(tmp_path):
+    def fail():
+        raise RuntimeError("disk full")
+
+    first = SharedGallery(str(tmp_path), reload_fn=lambda: None, on_leader=fail)
+    with pytest.raises(RuntimeError):
+        first.take_leadership()
+    assert not first.is_leader
+    started = []
+    second = SharedGallery(str(tmp_path), reload_fn=lambda: None, on_leader=lambda: started.append(1))
+    assert second.take_leadership() and started == [1]
+    assert not second.take_leadership()  # already leading: on_leader runs once
+    second.stop()
+
+
+def test_staleness_is_unknown_until_the_leader_syncs(tmp_path):
+    shared = SharedGallery(str(tmp_path), reload_fn=lambda: None)
+    assert shared.staleness() is None
+    SharedGallery(str(tmp_path), reload_fn=lambda: None).record_sync(time.time() - 30)
+    assert 30 <= shared.staleness() < 40
@@ -0,0 +1,51 @@
+import numpy as np
+
+
+def _interpreter_class():
+    """tflite_runtime's Interpreter when installed (small, no TensorFlow import), else tf.lite's."""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        from tensorflow.lite import Interpreter
+    return Interpreter
+
+
+class TFLiteModel:
+    """
+    Batch inference on a .tflite file exported by exportar.py.
+
+    The interpreter uses a fixed number of threads (`num_threads`) so that
+    several inference workers do not oversubscribe the CPU. Inputs and
+    outputs stay float32 even for int8 models (the quantize/dequantize ops
+    live inside the graph). Not thread-safe: call it from one thread (the
+    embedding batcher's worker), as with the Keras model it replaces.
+    """
+
+    def __init__(self, path, num_threads=1):
+        self.path = path
+        self.num_threads = num_threads
+        self.interpreter = _interpreter_class()(model_path=path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input['shape'][0])
+
+    @property
+    def input_shape(self):
+        return tuple(int(d) for d in self._input['shape'][1:])
+
+    def _resize(self, batch_size):
+        if batch_size != self._batch_size:
+            self.interpreter.resize_tensor_input(self._input['index'], [batch_size, *self.input_shape])
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+            self._output = self.interpreter.get_output_details()[0]
+            self._batch_size = batch_size
+
+    def predict(self, batch):
+        """Outputs for a (N, ...) float32 batch, shape (N, output_dim)."""
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        self._resize(len(batch))
+        self.interpreter.set_tensor(self._input['index'], batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output['index']).copy()